@@ -1,5 +1,6 @@
 
 import os
+import sys
 import json
 from random import shuffle
 import shutil
@@ -7,17 +8,21 @@ import shutil
 from PyQt5 import QtCore
 
 class Sample:
+    """ Dataset sample.
+
+    Datasets may hold millions of samples: attributes are slots (no per-instance __dict__) and labels and attributes,
+    shared by many samples, are interned so that samples point to a single string instead of one per decoded JSON entry.
+    """
+    __slots__ = ("label", "file", "attr", "proc", "originalFile", "featureFile")
+
     def __init__(self, sampleDict: dict = None):
-        self.file = "" # File URI
-        self.label = "" # Sample label
-        self.attr = "" # Sample attribute
-        self.proc = None # Processing description (None if original)
-        self.originalFile = None # Original file name (None if original)
-        self.featureFile = None
-        if sampleDict is not None:
-            for key in sampleDict.keys():
-                if key in self.__dict__.keys():
-                    self.__setattr__(key, sampleDict[key])
+        sampleDict = sampleDict if sampleDict is not None else dict()
+        self.file = sampleDict.get("file", "") # File URI
+        self.label = _intern(sampleDict.get("label", "")) # Sample label
+        self.attr = _intern(sampleDict.get("attr", "")) # Sample attribute
+        self.proc = sampleDict.get("proc", None) # Processing description (None if original)
+        self.originalFile = sampleDict.get("originalFile", None) # Original file name (None if original)
+        self.featureFile = sampleDict.get("featureFile", None)
 
     @property
     def sampleDesc(self) -> dict:
@@ -33,9 +38,22 @@ class Sample:
     def __eq__(self, other):
         return self.file == other.file
 
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
 class DataSet(QtCore.QObject):
     """ DataSet represent a collection of audio samples.
     The class provides methods to manage, select and export data.
+
+    The dataset is stored as a JSON file. Samples added or removed afterwards are appended to a JSON-lines journal next to it
+    (one {"add": [sample descriptions]} or {"remove": [files]} entry per line), replayed at load.
+    The journal is merged into the JSON file (compaction) by saveDataSet, which is called once the journal outgrows the JSON file.
+
+    The state (modification time and size) of the files is kept at load and after each write: read methods only reload the dataset
+    if the files have been modified by someone else since (see refresh).
+
+    Samples are indexed by label and by folder (label -> samples, folder -> label -> samples). samples must not be modified directly,
+    use the add / remove methods which keep the indexes up to date.
     """
 
     dataset_updated = QtCore.pyqtSignal(name='dataset_updated')
@@ -46,80 +64,167 @@ class DataSet(QtCore.QObject):
         self.dataSetName = dataSetName
         self.labels = labels
         self.samples = []
+        self.labelIndex = dict() # label -> samples
+        self.folderIndex = dict() # folder -> label -> samples
         self.datasetFile = ""
+        self.fileState = None # State of the dataset files matching the samples in memory
         self.prep = False
 
     def saveDataSet(self, datasetPath: str = None):
+        """ Write the whole dataset to datasetPath (default to the dataset file), its journal is cleared """
         datasetPath = datasetPath if datasetPath is not None else self.datasetFile
         datasetContent = dict()
         datasetContent["name"] = self.dataSetName
         datasetContent["labels"] = self.labels
         datasetContent["samples"] = [s.sampleDesc for s in self.samples]
         with open(datasetPath, 'w') as f:
-            json.dump(datasetContent, f)
+            f.write(json.dumps(datasetContent)) # Encoded at once, json.dump writes chunk by chunk
+        if os.path.isfile(DataSet.journalPath(datasetPath)):
+            os.remove(DataSet.journalPath(datasetPath))
+        if datasetPath == self.datasetFile:
+            self.fileState = self.currentFileState()
 
     def loadDataSet(self, datasetPath: str):
         if os.path.isfile(datasetPath):
             self.datasetFile = datasetPath
+            fileState = self.currentFileState() # Before reading: a concurrent write will be reloaded on next refresh
             with open(datasetPath, 'r') as f:
                 datasetContent = json.load(f)
             self.dataSetName = datasetContent["name"]
             self.labels = datasetContent["labels"]
             self.samples = [Sample(s) for s in datasetContent["samples"]]
+            self.replayJournal()
+            self.rebuildIndexes()
+            self.fileState = fileState
+
+    def currentFileState(self) -> tuple:
+        """ Return the (modification time, size) of the dataset file and journal, None for missing files """
+        state = []
+        for path in [self.datasetFile, DataSet.journalPath(self.datasetFile)]:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                state.append(None)
+        return tuple(state)
+
+    def refresh(self):
+        """ Reload the dataset if its files have been modified since it was loaded or written """
+        if os.path.isfile(self.datasetFile) and self.currentFileState() != self.fileState:
+            self.loadDataSet(self.datasetFile)
+
+    def replayJournal(self):
+        """ Apply the changes written in the journal since the last save """
+        journalPath = DataSet.journalPath(self.datasetFile)
+        if not os.path.isfile(journalPath):
+            return
+        with open(journalPath, 'r') as f:
+            for i, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print("Warning: Ignored invalid entry {} in {}".format(i + 1, journalPath)) # Interrupted write
+                    continue
+                if "add" in entry.keys():
+                    self.samples.extend([Sample(s) for s in entry["add"]])
+                if "remove" in entry.keys():
+                    removed = set(entry["remove"])
+                    self.samples = [s for s in self.samples if s.file not in removed]
+
+    def writeJournal(self, entry: dict):
+        """ Append a change to the journal, the dataset is saved instead if it has no file yet or if the journal is too large """
+        if all([len(changes) == 0 for changes in entry.values()]):
+            return
+        if not os.path.isfile(self.datasetFile):
+            self.saveDataSet()
+            return
+        upToDate = self.currentFileState() == self.fileState
+        journalPath = DataSet.journalPath(self.datasetFile)
+        line = json.dumps(entry) + "\n"
+        if os.path.isfile(journalPath) and os.path.getsize(journalPath) > 0:
+            with open(journalPath, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n": # Interrupted write, don't append to the invalid entry
+                    line = "\n" + line
+        with open(journalPath, 'a') as f:
+            f.write(line)
+        if not upToDate:
+            return # Modified by someone else: samples in memory are incomplete, they will be reloaded on next refresh
+        self.fileState = self.currentFileState()
+        if os.path.getsize(journalPath) > os.path.getsize(self.datasetFile):
+            self.saveDataSet() # Compaction
 
     ########################################################################
     ##### DATA MANAGEMENT
     ########################################################################
 
     def addSampleFiles(self, label, files):
-        for f in files:
-            self.samples.append(Sample({"label": label, "file": f}))
-        self.saveDataSet()
+        added = [Sample({"label": label, "file": f}) for f in files]
+        self.addSamples(added)
+        self.writeJournal({"add": [s.sampleDesc for s in added]})
         self.dataset_updated.emit()
     
     def addSample(self, sample: Sample):
-        self.samples.append(sample)
+        self.addSamples([sample])
+
+    def addSamples(self, samples: list):
+        """ Add samples in memory, without saving """
+        self.samples.extend(samples)
+        self.indexSamples(samples)
 
     def removeSamples(self, samples: list):
-        if self.datasetFile is not None:
-            self.loadDataSet(self.datasetFile)
-        for sample in self.samples:
-            if sample in samples:
-                self.samples.remove(sample)
-        self.saveDataSet()
+        self.refresh()
+        removed = self.removeFiles(set([sample.file for sample in samples]))
+        self.writeJournal({"remove": removed})
         self.dataset_updated.emit()
     
     def addFromManifest(self, manifestRoot, manifest):
-        for s in manifest:
-            self.samples.append(Sample({"label": s["label"], "file" : os.path.join(manifestRoot, s["file"])}))
-        self.saveDataSet()
+        added = [Sample({"label": s["label"], "file" : os.path.join(manifestRoot, s["file"])}) for s in manifest]
+        self.addSamples(added)
+        self.writeJournal({"add": [s.sampleDesc for s in added]})
         self.dataset_updated.emit()
     
     def removeFromFolders(self, folders : list):
         """ Remove samples located in given folders"""
-        if self.datasetFile is not None:
-            self.loadDataSet(self.datasetFile)
-        for sample in reversed(self.samples):
-            if os.path.dirname(sample.file) in folders:
-                self.samples.remove(sample)
-        self.saveDataSet()
+        self.refresh()
+        files = set()
+        for folder in folders:
+            for samples in self.folderIndex.get(folder, dict()).values():
+                files.update([sample.file for sample in samples])
+        removed = self.removeFiles(files)
+        self.writeJournal({"remove": removed})
         self.dataset_updated.emit()
 
+    def removeFiles(self, files: set) -> list:
+        """ Remove from memory every sample whose file is in files, in a single pass. Returns the removed files. """
+        if len(files) == 0:
+            return []
+        kept = [sample for sample in self.samples if sample.file not in files]
+        if len(kept) == len(self.samples):
+            return []
+        removed = set([sample.file for sample in self.samples]) & files
+        self.samples = kept
+        self.rebuildIndexes()
+        return list(removed)
+
     def getSamplesFolders(self) -> dict:
-        """ Return a dict of folder: n_samples """
+        """ Return a dict of folder: {label: n_samples} """
         folders = dict()
-        for sample in self.samples:
-            folder = os.path.dirname(sample.file)
-            label = sample.label
-            if label == "": 
-                label = "non-keyword"
-            if folder not in folders.keys():
-                folders[folder] = dict()
-            if label not in folders[folder].keys():
-                folders[folder][label] = 0
-            folders[folder][label] += 1
+        for folder, labels in self.folderIndex.items():
+            folders[folder] = {label if label != "" else "non-keyword": len(samples) for label, samples in labels.items()}
         return folders
 
+    def indexSamples(self, samples: list):
+        """ Add samples to the label and folder indexes """
+        for sample in samples:
+            self.labelIndex.setdefault(sample.label, []).append(sample)
+            self.folderIndex.setdefault(os.path.dirname(sample.file), dict()).setdefault(sample.label, []).append(sample)
+
+    def rebuildIndexes(self):
+        self.labelIndex = dict()
+        self.folderIndex = dict()
+        self.indexSamples(self.samples)
+
     ########################################################################
     ##### SET MANIPULATION
     ########################################################################
@@ -127,30 +232,33 @@ class DataSet(QtCore.QObject):
 
     def getsubsetbyLabel(self, label) -> list:
         label = label if label is not None else ""
-        return [s for s in self.samples if s.label == label]
+        return list(self.labelIndex.get(label, []))
+
+    def labelCount(self, label) -> int:
+        """ Return the number of samples of label (None or "" for non-hotword) """
+        return len(self.labelIndex.get(label if label is not None else "", []))
 
     def formSets(self, distribution: tuple) -> tuple:
-        if self.datasetFile is not None:
-            self.loadDataSet(self.datasetFile)
+        self.refresh()
         '''  Divide the dataset into 3 sets (train, val, test) according to the [distribution] values'''
         train_set = DataSet("train", self.labels)
         val_set = DataSet("val", self.labels)
         test_set = DataSet("test", self.labels)
     
         # Split the data by labels
-        shuffle(self.samples)
         for label in self.labels + [None]:
             subset = self.getsubsetbyLabel(label)
+            shuffle(subset)
             delimiter_1 = int(distribution[0] * len(subset))
             delimiter_2 = delimiter_1 + int(distribution[1] * len(subset))
-            train_set.samples.extend(subset[:delimiter_1])
-            val_set.samples.extend(subset[delimiter_1:delimiter_2])
-            test_set.samples.extend(subset[delimiter_2:])
+            train_set.addSamples(subset[:delimiter_1])
+            val_set.addSamples(subset[delimiter_1:delimiter_2])
+            test_set.addSamples(subset[delimiter_2:])
 
         return (train_set, val_set, test_set)
 
     def __iadd__(self, other):
-        self.samples.extend(other.samples)
+        self.addSamples(other.samples)
         return self
         
     ########################################################################
@@ -158,8 +266,7 @@ class DataSet(QtCore.QObject):
     ########################################################################
 
     def datasetInfo(self) -> str:
-        if self.datasetFile is not None:
-            self.loadDataSet(self.datasetFile)
+        self.refresh()
         sep = "\n" + "-"*15 +"\n"
         percent = lambda n, d : "{:.2f}%".format(n/d*100)
         info = "Dataset Name : {}\n".format(self.dataSetName)
@@ -172,7 +279,7 @@ class DataSet(QtCore.QObject):
 
         for label in self.labels + [None]:
             info += sep
-            n_sl = len(self.getsubsetbyLabel(label if label is not None else ""))
+            n_sl = self.labelCount(label)
             info += "Samples of {}:\n".format(label if label is not None else "non-hotword")
             info += "\tSample count: {} ({})\n".format(n_sl, percent(n_sl, n_sample))
             
@@ -180,13 +287,12 @@ class DataSet(QtCore.QObject):
 
     def datasetValues(self) -> list:
         """ Return dataset data values as a list of tuples of (label, number of samples, percentage on dataset) """
-        if self.datasetFile is not None:
-            self.loadDataSet(self.datasetFile)
+        self.refresh()
         values = []
         percent = lambda n, d : "{:.2f}%".format(n/(d if d > 0 else 1)*100)
         n_sample = len(self.samples)
         for label in self.labels + [None]:
-            n_sl = len(self.getsubsetbyLabel(label if label is not None else ""))
+            n_sl = self.labelCount(label)
             label = label if label is not None else "non-hotword"
             values.append((label, n_sl, percent(n_sl, n_sample)))
         return values
@@ -228,6 +334,11 @@ class DataSet(QtCore.QObject):
     ########################################################################
     ##### UTILS
     ########################################################################
+    @classmethod
+    def journalPath(cls, datasetPath: str) -> str:
+        """ Return the journal location of a dataset file """
+        return datasetPath + ".journal"
+
     @classmethod
     def listFolder(cls, folderPath: str, recursive: bool = False, ext: str = '.wav') -> list:
         """ List folder content and return a list of absolute path. 
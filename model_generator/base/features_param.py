@@ -1,6 +1,9 @@
 import json
+import hashlib
 
-from processing.mfcc import mfcc_feats
+import numpy as np
+
+from processing.mfcc import mfcc_feats, StreamingMFCC
 
 class _Feature:
     sample_rate = 16000
@@ -46,8 +49,19 @@ class _Feature:
         output["feature_type"] = self.feature_type
         return output
 
+    @property
+    def digest(self) -> str:
+        """ Hash of the features parameters (profile name excluded), identifies extracted features """
+        manifest = self.generateManifest()
+        manifest.pop("name")
+        return hashlib.sha1(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+
     def extract_function(self) -> callable:
         return lambda x : None
+
+    def createStreamExtractor(self):
+        """ Return a stateful extractor with a push(samples) method returning the new features rows, None if not supported """
+        return None
     
     def toShortDesc(self) -> str:
         desc = "{} :{}\n".format(self.name, self.feature_type)
@@ -124,6 +138,16 @@ class MFCC_Features(_Feature):
                     num_coef = self.n_coefs, 
                     hamming = self.window_fun == 'hamming',
                     preEmp  = self.emphasis_factor)
+
+    def createStreamExtractor(self) -> StreamingMFCC:
+        return StreamingMFCC(self.sample_rate, 
+                             self.window_s, 
+                             self.window_stride_s, 
+                             self.fft_size, 
+                             num_filter = self.n_filters, 
+                             num_coef = self.n_coefs, 
+                             hamming = self.window_fun == 'hamming',
+                             preEmp  = self.emphasis_factor)
                     
     def toShortDesc(self) -> str:
         desc = _Feature.toShortDesc(self)
@@ -1,7 +1,6 @@
 import json
 
-from tensorflow.keras.models import Sequential, save_model
-from tensorflow.keras.layers import Dense, GRU
+# Keras is imported on first use to keep tensorflow out of the application startup
 
 
 class _Layer:
@@ -75,20 +74,23 @@ class GRU_Layer(_Layer):
         params.append(("reset_after", bool, self.reset_after))
         return params
 
-    def getKerasLayer(self, input_shape = None):
+    def getKerasLayer(self, input_shape = None, stateful: bool = False):
+        from tensorflow.keras.layers import GRU
         if input_shape is None:
             return GRU(self.n_cell,
                         activation=self.activation_fun,
                         name="input" if self.is_input else self.name,
                         unroll=self.unroll,
-                        reset_after=self.reset_after)
+                        reset_after=self.reset_after,
+                        stateful=stateful)
         else:
             return GRU(self.n_cell,
                         activation=self.activation_fun,
                         input_shape=input_shape,
                         name="input" if self.is_input else self.name,
                         unroll=self.unroll,
-                        reset_after=self.reset_after)
+                        reset_after=self.reset_after,
+                        stateful=stateful)
     
     def toShortDesc(self) -> str:
         return "GRU Layer {} cells ({})".format(self.n_cell, self.activation_fun)
@@ -120,6 +122,7 @@ class Dense_Layer(_Layer):
         return params
 
     def getKerasLayer(self, input_shape = None):
+        from tensorflow.keras.layers import Dense
         return Dense(units=self.n_cell, activation=self.activation_fun)
 
     def toShortDesc(self) -> str:
@@ -144,6 +147,7 @@ class Output_Layer(_Layer):
         return layer_dict
 
     def getKerasLayer(self, input_shape = None):
+        from tensorflow.keras.layers import Dense
         return Dense(units=self.n_cell, activation=self.activation_fun, name="output")
     
     def toShortDesc(self) -> str:
@@ -182,7 +186,8 @@ class _Model:
         except Exception as e:
             raise Exception("Could not write model at {}: {}".format(modelPath, e))
     
-    def toKerasModel(self, input_shape: tuple, output_shape: int) -> Sequential:
+    def toKerasModel(self, input_shape: tuple, output_shape: int) -> "Sequential":
+        from tensorflow.keras.models import Sequential
         model = Sequential()
         model.add(self.layers[0].getKerasLayer(input_shape=input_shape))
         for layer in self.layers[1:-1]:
@@ -227,6 +232,25 @@ class GRU_Model(_Model):
         except Exception as e:
             raise Exception("Cannot load model at {} wrong format".format(modelPath))
 
+    def toStreamingKerasModel(self, model) -> "Sequential":
+        """ Return a stateful copy of a trained keras model taking one features frame per call (batch_shape (1, 1, n_feats)).
+        The input layer recurrent state is kept between calls until its reset_states() is called.
+        """
+        from tensorflow.keras import Input
+        from tensorflow.keras.models import Sequential
+        streaming = Sequential()
+        streaming.add(Input(batch_shape=(1, 1, model.input_shape[-1])))
+        streaming.add(self.layers[0].getKerasLayer(stateful=True))
+        for layer in self.layers[1:-1]:
+            streaming.add(layer.getKerasLayer())
+        self.layers[-1].n_cell = model.output_shape[-1]
+        streaming.add(self.layers[-1].getKerasLayer())
+        try:
+            streaming.set_weights(model.get_weights())
+        except Exception as e:
+            raise Exception("Model {} layers don't match the trained model: {}".format(self.name, e))
+        return streaming
+
 
 def getModelbyType(model_type) -> _Model:
     if model_type == "gru":
@@ -245,4 +269,5 @@ def getLayerbyType(layer_type) -> _Layer:
         raise Exception("Error: Layer {} not known.".format(layer_type))
 
 def saveModel(model, path):
+    from tensorflow.keras.models import save_model
     save_model(model, path)
\ No newline at end of file
@@ -24,6 +24,7 @@ class Project(QtCore.QObject):
         self.project_location = ""
         self.project_file = ""
         self.isOpen = False
+        self.datasetCache = dict() # Loaded datasets by file, see getDatasetByName
 
     ########################################################################
     ##### DATASET
@@ -46,6 +47,7 @@ class Project(QtCore.QObject):
             if len(usedBy) > 0:
                 raise Exception("Can't remove dataset. In use by trained models: \n{}".format("-" + "\n-".join(usedBy)))
             self.datasets.remove(name)
+            self.datasetCache.pop(os.path.join(dataSetPath, name + ".json"), None)
             shutil.rmtree(dataSetPath)
             self._write()
             self.dataset_updated.emit()
@@ -54,11 +56,17 @@ class Project(QtCore.QObject):
 
 
     def getDatasetByName(self, name) -> DataSet:
+        """ Return the dataset, loaded once and shared by callers. It is reloaded if its files have been modified elsewhere. """
         if name not in self.datasets:
             return None
-        dataset = DataSet()
         dataSetPath = os.path.join(self.project_location, "data", name, name+".json")
+        if dataSetPath in self.datasetCache.keys():
+            dataset = self.datasetCache[dataSetPath]
+            dataset.refresh()
+            return dataset
+        dataset = DataSet()
         dataset.loadDataSet(dataSetPath)
+        self.datasetCache[dataSetPath] = dataset
         return dataset
 
     def addExistingDataSet(self, datasetPath):
@@ -199,6 +207,7 @@ class Project(QtCore.QObject):
         """
         self.project_file = project_file
         self.project_location = os.path.dirname(project_file)
+        self.datasetCache = dict()
         with open(project_file, 'r') as f:
             manifest = json.load(f)
         try:
@@ -249,6 +258,7 @@ class Project(QtCore.QObject):
 
         self.project_file = os.path.join(project_location, project_name + ".proj")
         self.project_location = os.path.join(project_location)
+        self.datasetCache = dict()
         self._write()
         return self
 
@@ -27,9 +27,6 @@ class Trained:
         self.features = features
         self.model = model
 
-        if not os.path.isdir(self.featureFolder):
-            os.mkdir(self.featureFolder)
-
         train_set, val_set, test_set = self.dataset.formSets(distrib)
 
         train_set.saveDataSet(self.trainSetPath)
@@ -48,7 +45,7 @@ class Trained:
             except:
                 continue
         
-        if os.path.isdir(self.featureFolder):
+        if os.path.isdir(self.featureFolder): # Features saved by the trained model before the shared feature cache
             shutil.rmtree(self.featureFolder)
 
         self.dataset = None
@@ -115,6 +112,8 @@ class Trained:
             os.remove(self.trainedModelPath)
         if os.path.isfile(self.logFilePath):
             os.remove(self.logFilePath)
+        if os.path.isfile(self.predictionCachePath):
+            os.remove(self.predictionCachePath)
 
         self.writeTrained()
 
@@ -154,9 +153,28 @@ class Trained:
     def trainedModelPath(self) -> str:
         return os.path.join(self.folder, self.name + ".hdf5")
 
+    @property
+    def predictionCachePath(self) -> str:
+        """ Evaluation predictions of the trained model """
+        return os.path.join(self.folder, self.name + "_predictions.npz")
+
     @property
     def featureFolder(self) -> str:
         return os.path.join(self.folder, "features")
+
+    @property
+    def featureCacheFolder(self) -> str:
+        """ Feature cache shared by all trained models of the project.
+
+        The cache is never pruned: rows of modified or deleted audio files and stores of deleted features profiles stay
+        until the folder is removed (it is rebuilt on next training).
+        """
+        return os.path.join(os.path.dirname(os.path.dirname(self.folder)), "features", "cache")
+
+    @property
+    def audioCacheFolder(self) -> str:
+        """ Decoded audio cache shared by all trained models of the project """
+        return os.path.join(self.featureCacheFolder, "audio")
     
     @property
     def logFilePath(self) -> str:
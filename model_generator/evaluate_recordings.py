@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+
+from base import Project
+from processing.inference_engine import backends
+from processing.long_audio import evaluate_recordings
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a trained model on long recordings: false alarms per hour and miss rate by threshold.")
+    parser.add_argument("project", help="Project file")
+    parser.add_argument("trained", help="Trained model name")
+    parser.add_argument("manifest", help="Recordings manifest (JSON): a list of {\"file\": path, \"events\": [{\"keyword\": keyword, \"start\": s, \"end\": s}]}, "
+                                         "events being the keywords said in the recording. Relative paths are relative to the manifest")
+    parser.add_argument("-t", "--thresholds", type=float, nargs="+", default=[0.1 * i for i in range(1, 10)], help="Detection thresholds (default 0.1 to 0.9)")
+    parser.add_argument("-o", "--output", help="Report file (JSON). Printed if not set")
+    parser.add_argument("--stride", type=int, default=1, help="Features frames between two scored windows (default 1)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Windows predicted at once (default 1024)")
+    parser.add_argument("--backend", choices=list(backends.keys()), default="function", help="Inference backend (default function)")
+    args = parser.parse_args()
+
+    project = Project()
+    project.open_project(args.project)
+    trained = project.getTrained(args.trained)
+    if not trained.isTrained:
+        print("Trained model {} has not been trained yet.".format(args.trained), file=sys.stderr)
+        sys.exit(1)
+
+    with open(args.manifest, 'r') as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(args.manifest))
+    recordings = []
+    for recording in manifest:
+        events = [(event["keyword"], event["start"], event["end"]) for event in recording.get("events", [])]
+        recordings.append((os.path.join(root, recording["file"]), events))
+
+    from processing.keras_utils import loadModel
+    metrics = evaluate_recordings(recordings,
+                                  trained.features,
+                                  loadModel(trained.trainedModelPath),
+                                  project.keywords,
+                                  args.thresholds,
+                                  stride=args.stride,
+                                  batch_size=args.batch_size,
+                                  backend=args.backend,
+                                  traceCallBack=lambda msg: print(msg, file=sys.stderr))
+    report = {"trained": trained.name, "recordings": len(recordings), "metrics": metrics}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import os
 import json
 
 from PyQt5 import QtCore, QtGui, QtWidgets, QtMultimedia
@@ -5,13 +6,16 @@ from PyQt5 import QtCore, QtGui, QtWidgets, QtMultimedia
 import numpy as np
 
 from .module import _Module
-from base import DataSet, Project, Sample
+from base import DataSet, Project
 from interfaces.modules.ui.test_ui import Ui_Test
 from interfaces.dialogs import RemoveSamplesDialog
 from interfaces.utils.assets import getIconPath
 from interfaces.utils.qtutils import labeledTextLine, horizontalLine, empty_layout
-from processing.files_to_feats import prepare_input_output
-from processing.keras_utils import loadModel
+from interfaces.widgets.detection_chart import DetectionChart
+from processing.files_to_feats import prepare_input_output, createOutputs
+from processing.feature_store import sampleKey
+from processing.metrics import ThresholdSweep
+from processing.prediction_cache import PredictionCache, modelFingerprint
 
 
 class Evaluation(_Module):
@@ -29,20 +33,31 @@ class Evaluation(_Module):
         self.project = project
         self.currentProfile = None
         self.table_items = [] #Contain the confusion matrix items 
+        self.predictionCache = dict() # Predictions by (profile, evaluated sets): (signature, samples, sweep), saved predictions are in PredictionCache
+        self.results = None # (samples, sweep) currently displayed
+        self.sound = None # Sample being played, created on play
 
         self.populateProfiles()
         self.init_conf_table()
+        self.init_chart()
+        self.init_false_samples()
 
 
         # CONNECT
         self.project.trained_updated.connect(self.populateProfiles)
         self.ui.select_all_CB.toggled.connect(self.onSelectAllToggled)
         self.ui.profile_CB.currentTextChanged.connect(self.onProfileChanged)
+        self.ui.threshold.valueChanged.connect(self.onThresholdChanged)
+        self.ui.training_set.toggled.connect(self.showCachedResults)
+        self.ui.validation_set.toggled.connect(self.showCachedResults)
+        self.detectionChart.thresholdPicked.connect(self.onThresholdPicked)
         
         ## Buttons
         self.ui.evaluate_PB.clicked.connect(self.onEvaluateClicked)
         self.ui.remove_PB.clicked.connect(self.onRemoveClicked)
 
+        self.showCachedResults()
+
     ########################################################################
     ##### UI LOGIC AND UPDATES
     ########################################################################
@@ -80,31 +95,58 @@ class Evaluation(_Module):
         self.ui.evaluate_PB.setEnabled(active)
         self.ui.remove_PB.setEnabled(active)
         self.ui.externalTest_group.setEnabled(active)
+        self.showCachedResults()
 
     def onEvaluateClicked(self):
         self.ui.evaluate_PB.setEnabled(False)
-        self.reset_table()
-        self.clearFalseSampleList()
         self.evaluate()
         self.ui.evaluate_PB.setEnabled(True)
 
+    def onThresholdChanged(self, value):
+        if self.results is not None:
+            self.showResults()
+
+    def onThresholdPicked(self, threshold: float):
+        """ Threshold picked on the chart: kept at full precision, the spin box displays it rounded """
+        self.pickedThreshold = threshold
+        self.ui.threshold.blockSignals(True)
+        self.ui.threshold.setValue(threshold)
+        self.ui.threshold.blockSignals(False)
+        self.onThresholdChanged(threshold)
+
+    def currentThreshold(self) -> float:
+        """ The threshold picked on the chart while the spin box displays it, the spin box value otherwise """
+        value = self.ui.threshold.value()
+        if self.pickedThreshold is not None and abs(self.pickedThreshold - value) <= 0.5 * 10 ** -self.ui.threshold.decimals():
+            return self.pickedThreshold
+        return value
+
+    def showCachedResults(self):
+        """ Display the results of the current profile and sets if their predictions are cached and up to date """
+        self.results = None
+        if self.currentProfile is not None:
+            key = self.cacheKey()
+            signature = self.cacheSignature()
+            if key in self.predictionCache.keys() and self.predictionCache[key][0] == signature:
+                self.results = self.predictionCache[key][1:]
+            elif os.path.isfile(self.currentProfile.predictionCachePath) and os.path.isfile(self.currentProfile.trainedModelPath):
+                try:
+                    self.results = self.savedResults(self.loadEvaluatedSets(), self.openPredictionCache())
+                except Exception as e:
+                    print("Could not load saved predictions: {}".format(e))
+                if self.results is not None:
+                    self.predictionCache[key] = (signature,) + self.results
+        self.showResults()
+
     def displayState(self, msg):
         self.ui.progress_Label.setText(msg)
         QtWidgets.QApplication.instance().processEvents()
 
     def onSelectAllToggled(self, value):
-        for i in range(self.ui.false_samples.count()):
-            item = self.ui.false_samples.item(i)
-            widget = self.ui.false_samples.itemWidget(item)
-            layer = widget.CB.setChecked(value)
+        self.falseSamples.setAllChecked(value)
 
     def onRemoveClicked(self):
-        selectedSamples = []
-        for i in range(self.ui.false_samples.count()):
-            item = self.ui.false_samples.item(i)
-            widget = self.ui.false_samples.itemWidget(item)
-            if widget.CB.isChecked():
-                selectedSamples.append(widget.sample)
+        selectedSamples = self.falseSamples.checkedSamples()
         if len(selectedSamples) == 0:
             return
         testSet = DataSet()
@@ -124,11 +166,8 @@ class Evaluation(_Module):
         dialog.show()
 
     def onSamplesRemoved(self):
-        for i in reversed(range(self.ui.false_samples.count())):
-            item = self.ui.false_samples.item(i)
-            widget = self.ui.false_samples.itemWidget(item)
-            if widget.CB.isChecked():
-                self.ui.false_samples.takeItem(i)
+        self.predictionCache = {key: value for key, value in self.predictionCache.items() if key[0] != self.currentProfile.name}
+        self.falseSamples.removeChecked()
 
     ########################################################################
     ##### TABLE
@@ -172,75 +211,159 @@ class Evaluation(_Module):
          for r in self.table_items:
             for item in r:
                 item.setData(0,0)
+                item.setText("")
     
     ########################################################################
     ##### LIST
     ########################################################################
     
+    def init_false_samples(self):
+        # The generated QListWidget creates an item per sample, replaced by a view on the False_Samples model
+        listWidget = self.ui.false_samples
+        self.ui.false_samples = QtWidgets.QListView(self)
+        self.ui.false_samples.setObjectName("false_samples")
+        self.ui.false_samples.setUniformItemSizes(True)
+        self.ui.verticalLayout_3.replaceWidget(listWidget, self.ui.false_samples)
+        listWidget.deleteLater()
+
+        self.falseSamples = False_Samples(['non-hotword'] + self.project.keywords)
+        self.ui.false_samples.setModel(self.falseSamples)
+        self.playDelegate = Play_Delegate(self.ui.false_samples)
+        self.ui.false_samples.setItemDelegate(self.playDelegate)
+        self.playDelegate.play_requested.connect(self.playSample)
+
     def clearFalseSampleList(self):
-        self.ui.false_samples.clear()
-    
-    def addFalseSample(self, sample: Sample, ct_cp: tuple):
-        l_item = QtWidgets.QListWidgetItem()
-        l_widget = False_Activations(sample, ct_cp, ['non-hotword'] + self.project.keywords)
-        #self.ui.false_samples.append(l_widget)
-        l_item.setSizeHint(l_widget.sizeHint())
-        self.ui.false_samples.addItem(l_item)
-        self.ui.false_samples.setItemWidget(l_item, l_widget)
+        self.falseSamples.setSamples([], np.array([], dtype=int), np.array([], dtype=int))
+
+    def playSample(self, row: int):
+        self.sound = QtMultimedia.QSound(self.falseSamples.samples[row].file)
+        self.sound.play()
 
     ########################################################################
-    ##### PROCESSING
+    ##### CHART
     ########################################################################
 
-    def evaluate(self):
-        # Data presentation
-        evalSet = []
-        
-        testSet = DataSet()
-        testSet.loadDataSet(self.currentProfile.testSetPath)
-        evalSet.append(testSet)
+    def init_chart(self):
+        self.ui.threshold.setDecimals(4)
+        self.pickedThreshold = None # Full precision threshold picked on the chart (see currentThreshold)
+        self.detectionChart = DetectionChart()
+        self.chartSweep = None # ThresholdSweep displayed by the chart
+        self.ui.horizontalLayout_2.addWidget(self.detectionChart)
 
-        if self.ui.training_set.isChecked():
-            trainSet = DataSet()
-            trainSet.loadDataSet(self.currentProfile.trainSetPath)
-            evalSet.append(trainSet)
+    ########################################################################
+    ##### PROCESSING
+    ########################################################################
 
+    def evaluatedSetPaths(self) -> list:
+        setPaths = [self.currentProfile.testSetPath]
+        if self.ui.training_set.isChecked():
+            setPaths.append(self.currentProfile.trainSetPath)
         if self.ui.validation_set.isChecked():
-            valSet = DataSet()
-            valSet.loadDataSet(self.currentProfile.valSetPath)
-            evalSet.append(valSet)
+            setPaths.append(self.currentProfile.valSetPath)
+        return setPaths
+
+    def cacheKey(self) -> tuple:
+        return (self.currentProfile.name, self.ui.training_set.isChecked(), self.ui.validation_set.isChecked())
+
+    def cacheSignature(self) -> tuple:
+        """ Modification times of the model and evaluated sets, cached predictions are stale when it changes """
+        setPaths = self.evaluatedSetPaths()
+        paths = [self.currentProfile.trainedModelPath] + setPaths + [DataSet.journalPath(path) for path in setPaths]
+        return tuple([os.path.getmtime(path) if os.path.isfile(path) else None for path in paths])
+
+    def loadEvaluatedSets(self) -> list:
+        evalSet = []
+        for setPath in self.evaluatedSetPaths():
+            dataset = DataSet()
+            dataset.loadDataSet(setPath)
+            evalSet.append(dataset)
+        return evalSet
+
+    def openPredictionCache(self) -> PredictionCache:
+        return PredictionCache(self.currentProfile.predictionCachePath, modelFingerprint(self.currentProfile.trainedModelPath))
+
+    def savedResults(self, evalSet: list, cache: PredictionCache) -> tuple:
+        """ Return (samples, sweep) from the saved predictions, None if a sample has no saved prediction """
+        samples = []
+        keys = []
+        for dataset in evalSet:
+            for sample in dataset.samples:
+                try:
+                    keys.append(sampleKey(sample.file))
+                except Exception:
+                    return None
+                samples.append(sample)
+        if len(samples) == 0 or len(cache.missing(keys)) > 0:
+            return None
+        labels = createOutputs(evalSet[0].labels)
+        expectedOutput = np.array([labels[sample.label] for sample in samples])
+        return samples, ThresholdSweep(expectedOutput, cache.get(keys))
+
+    def evaluate(self):
+        key = self.cacheKey()
+        signature = self.cacheSignature()
+        if key in self.predictionCache.keys() and self.predictionCache[key][0] == signature:
+            self.results = self.predictionCache[key][1:]
+            self.showResults()
+            return
 
+        # Data presentation
+        evalSet = self.loadEvaluatedSets()
+        cache = self.openPredictionCache()
+        self.results = self.savedResults(evalSet, cache)
+        if self.results is None:
+            self.results = self.predict(evalSet, cache)
+        self.predictionCache[key] = (signature,) + self.results
+        self.showResults()
+        self.displayState("Evaluated {} samples".format(len(self.results[0])))
+
+    def predict(self, evalSet: list, cache: PredictionCache) -> tuple:
+        """ Predict the samples missing from cache, returns (samples, sweep) """
         # Feature extraction
         samples, inputs, expectedOutput = prepare_input_output(evalSet, 
                                                                 self.currentProfile.features,
-                                                                save_features_folder=self.currentProfile.featureFolder,
+                                                                save_features_folder=self.currentProfile.featureCacheFolder,
                                                                 traceCallBack=self.displayState,
-                                                                returnSamples=True)
-
-        # Load model
-        self.displayState("Loading model ...")
-        model = loadModel(self.currentProfile.trainedModelPath)
-
-        # Predictions
-        self.displayState("Predicting ...")
-        predictions = model.predict(inputs)
+                                                                returnSamples=True,
+                                                                n_workers=os.cpu_count(),
+                                                                audio_cache_folder=self.currentProfile.audioCacheFolder)
+
+        keys = [sampleKey(sample.file) for sample in samples]
+        missing = cache.missing(keys)
+        if len(missing) > 0:
+            # Load model
+            self.displayState("Loading model ...")
+            from processing.keras_utils import loadModel
+            model = loadModel(self.currentProfile.trainedModelPath)
+
+            # Predictions
+            self.displayState("Predicting ...")
+            cache.update([keys[i] for i in missing], model.predict(inputs[missing]))
+            cache.write()
+
+        return samples, ThresholdSweep(expectedOutput, cache.get(keys))
+
+    def showResults(self):
+        """ Display the confusion matrix, metrics and false samples at the current threshold """
+        self.reset_table()
+        self.clearFalseSampleList()
+        empty_layout(self.ui.metric_layout)
+        if self.results is None:
+            self.detectionChart.clear()
+            self.chartSweep = None
+            return
+        samples, sweep = self.results
+        if self.chartSweep is not sweep:
+            self.detectionChart.load(*sweep.curves())
+            self.chartSweep = sweep
+        threshold = self.currentThreshold()
+        self.detectionChart.setOperatingPoint(threshold)
 
         # Result classification
-        result_matrix = np.zeros((len(evalSet[0].labels) + 1, len(evalSet[0].labels) + 1))
-        for sample, prediction, expectedResult in zip(samples, predictions, expectedOutput):
-            ct = np.where(expectedResult > 0.0)[0] # Class truth
-            if len(ct) == 0:
-                ct = 0
-            else:
-                ct = ct[0] + 1
-            triggered = max(prediction) > self.ui.threshold.value()
-            if not triggered:
-                cp = 0 
-            else:
-                cp = np.argmax(prediction) + 1 # Class predicted
-            result_matrix[ct][cp] += 1
-            if ct != cp:
-                self.addFalseSample(sample, (ct, cp))
+        result_matrix = sweep.confusionMatrix(threshold)
+        predicted = sweep.classesPredicted(threshold)
+        false = np.flatnonzero(predicted != sweep.truth)
+        self.falseSamples.setSamples([samples[i] for i in false], sweep.truth[false], predicted[false])
 
         # Display results
         self.setTableValues(result_matrix)
@@ -262,27 +385,84 @@ class Evaluation(_Module):
             self.ui.metric_layout.addWidget(labeledTextLine('False Negative', np.sum(result_matrix[i+1,:]) - result_matrix[i+1, i+1], np.sum(result_matrix[i+1,:])))
             self.ui.metric_layout.addWidget(labeledTextLine('False Positive', np.sum(result_matrix[:,i+1]) - result_matrix[i+1, i+1], n_samples - np.sum(result_matrix[i+1,:])))
 
-class False_Activations(QtWidgets.QWidget):
-    def __init__(self, sample: Sample, ct_cp: tuple, labels: list):
-        super().__init__()
-        self.sample = sample
-        self.sound = QtMultimedia.QSound(self.sample.file)
-        layout = QtWidgets.QHBoxLayout()
-        self.CB = QtWidgets.QCheckBox(self.sample.file)
-        self.CB.setToolTip(self.sample.file)
-        label = QtWidgets.QLabel("<font color='red'>{}</font> --> <font color='green'>{}</font>".format(labels[ct_cp[1]], labels[ct_cp[0]]))
-        self.play_button = QtWidgets.QPushButton()
-        play_icon = QtGui.QPixmap(getIconPath(__file__, "icons/play.png"))
-        self.play_button.setIcon(QtGui.QIcon(play_icon))
-        self.play_button.setIconSize(QtCore.QSize(20,20))
-        layout.addWidget(self.CB)
-        layout.addWidget(label)
-        layout.addWidget(self.play_button)
-        layout.addStretch()
-        layout.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
-        self.setLayout(layout)
-
-        self.play_button.clicked.connect(self.play_audio)
-
-    def play_audio(self):
-        self.sound.play()
\ No newline at end of file
+class False_Samples(QtCore.QAbstractListModel):
+    """ Misclassified samples, checkable. Rows are only formatted when displayed. """
+    def __init__(self, labels: list):
+        QtCore.QAbstractListModel.__init__(self)
+        self.labels = labels
+        self.samples = []
+        self.truth = np.array([], dtype=int) # Class truth
+        self.predicted = np.array([], dtype=int) # Class predicted
+        self.checked = np.array([], dtype=bool)
+
+    def setSamples(self, samples: list, truth: np.ndarray, predicted: np.ndarray):
+        self.beginResetModel()
+        self.samples = samples
+        self.truth = truth
+        self.predicted = predicted
+        self.checked = np.zeros(len(samples), dtype=bool)
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.samples)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == QtCore.Qt.DisplayRole:
+            return "{}    {} --> {}".format(self.samples[row].file, self.labels[self.predicted[row]], self.labels[self.truth[row]])
+        if role == QtCore.Qt.ToolTipRole:
+            return "{}\nPredicted {}, expected {}".format(self.samples[row].file, self.labels[self.predicted[row]], self.labels[self.truth[row]])
+        if role == QtCore.Qt.CheckStateRole:
+            return QtCore.Qt.Checked if self.checked[row] else QtCore.Qt.Unchecked
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole) -> bool:
+        if not index.isValid() or role != QtCore.Qt.CheckStateRole:
+            return False
+        self.checked[index.row()] = value == QtCore.Qt.Checked
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsUserCheckable
+
+    def setAllChecked(self, value: bool):
+        if len(self.samples) == 0:
+            return
+        self.checked[:] = value
+        self.dataChanged.emit(self.index(0), self.index(len(self.samples) - 1), [QtCore.Qt.CheckStateRole])
+
+    def checkedSamples(self) -> list:
+        return [self.samples[i] for i in np.flatnonzero(self.checked)]
+
+    def removeChecked(self):
+        kept = np.flatnonzero(~self.checked)
+        self.setSamples([self.samples[i] for i in kept], self.truth[kept], self.predicted[kept])
+
+class Play_Delegate(QtWidgets.QStyledItemDelegate):
+    """ Paints a play button at the end of each row, no widget is created """
+    play_requested = QtCore.pyqtSignal(int)
+    iconSize = 20
+
+    def __init__(self, parent=None):
+        QtWidgets.QStyledItemDelegate.__init__(self, parent)
+        self.icon = QtGui.QIcon(QtGui.QPixmap(getIconPath(__file__, "icons/play.png")))
+
+    def iconRect(self, rect: QtCore.QRect) -> QtCore.QRect:
+        return QtCore.QRect(rect.right() - self.iconSize - 4, rect.top() + (rect.height() - self.iconSize) // 2, self.iconSize, self.iconSize)
+
+    def paint(self, painter, option, index):
+        QtWidgets.QStyledItemDelegate.paint(self, painter, option, index)
+        self.icon.paint(painter, self.iconRect(option.rect))
+
+    def sizeHint(self, option, index):
+        size = QtWidgets.QStyledItemDelegate.sizeHint(self, option, index)
+        return QtCore.QSize(size.width() + self.iconSize + 8, max(size.height(), self.iconSize + 4))
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QtCore.QEvent.MouseButtonRelease and self.iconRect(option.rect).contains(event.pos()):
+            self.play_requested.emit(index.row())
+            return True
+        return QtWidgets.QStyledItemDelegate.editorEvent(self, event, model, option, index)
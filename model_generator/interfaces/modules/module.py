@@ -39,5 +39,9 @@ class _Module(QtWidgets.QWidget):
     def displayStatus(self, message: str, timeout: int = 0):
         self.newStatus.emit(message, timeout)
 
+    def teardown(self):
+        """ Called before the module is discarded (project closed or application quit) to stop its background work """
+        pass
+
 
 
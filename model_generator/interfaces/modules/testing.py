@@ -18,12 +18,16 @@ class Testing(_Module):
     moduleHelp = '''
                  Test your trained model with your microphone.
                  '''
+    streamingMode = None # "continuous" or "windowed" to run the model one frame at a time (see StreamingModel). In windowed mode, only the full window predictions are displayed and compared to the threshold (one every window)
+    inferenceBackend = "function" # Inference backend name (see processing.inference_engine.backends)
+
     def __init__(self, project : Project):
         _Module.__init__(self, project)
         self.ui = Ui_Infere()
         self.ui.setupUi(self)
         self.project = project
         self.currentProfile = None
+        self.inferenceEngine = None
 
         self.isRunning = False
         self.timer = QtCore.QTimer(self)
@@ -78,10 +82,18 @@ class Testing(_Module):
         self.currentProfile = self.project.getTrained(name)
         self.ui.profile_CB.setToolTip(self.currentProfile.shortDesc())
         self.chart.clear()
-        self.inferenceEngine = InferenceEngine(self.currentProfile.features, self.currentProfile.trainedModelPath, self.ui.threshold.value())
+        self.inferenceEngine = None # Created on first test, loading the model requires tensorflow
+        self.ui.test_PB.setEnabled(True)
+
+    def createInferenceEngine(self):
+        self.inferenceEngine = InferenceEngine(self.currentProfile.features, 
+                                               self.currentProfile.trainedModelPath, 
+                                               self.ui.threshold.value(), 
+                                               modelDesc=self.currentProfile.model, 
+                                               streamingMode=self.streamingMode,
+                                               backend=self.inferenceBackend)
         self.inferenceEngine.prediction.connect(self.chart.addValue)
         self.inferenceEngine.sample_detected.connect(self.onActivationSamples)
-        self.ui.test_PB.setEnabled(True)
 
     def onTestClicked(self):
         if self.isRunning:
@@ -90,6 +102,8 @@ class Testing(_Module):
             self.isRunning = False
         else:
             self.chart.clear()
+            if self.inferenceEngine is None:
+                self.createInferenceEngine()
             self.inferenceEngine.startInference()
             self.ui.test_PB.setText("Stop")
             self.isRunning = True
@@ -8,8 +8,8 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 
 from .module import _Module
 
-from base import Project, _Feature, DataSet
-from base.model import _Model, _Layer, saveModel
+from base import Project, _Feature
+from base.model import _Model, _Layer
 from base.trained import Trained
 
 from interfaces.modules.ui.training_ui import Ui_Form
@@ -18,9 +18,7 @@ from interfaces.widgets.training_charts import TrainingChart
 from interfaces.utils.qtutils import create_horizontal_spacer, create_vertical_line
 from interfaces.utils.assets import getIconPath
 
-from processing.files_to_feats import prepare_input_output
-from processing.keras_utils import callbacksDef, loadModel
-from processing.training import TrainingSession
+from processing.training import TrainingSession, TrainingWorker
 
 class Training(_Module):
     moduleTitle= "Training"
@@ -30,6 +28,8 @@ class Training(_Module):
     moduleHelp = '''
                  Choose your data, your features, your model architecture and train.
                  '''
+    streamInput = True # Stream training batches from the feature cache instead of loading whole sets in memory
+
     def __init__(self, project : Project):
         _Module.__init__(self, project)
         self.ui = Ui_Form()
@@ -38,6 +38,8 @@ class Training(_Module):
         self.currentTrained = None
         self.isTraining = False
         self.trainingSession = None
+        self.trainingThread = None
+        self.trainingWorker = None
         
         self.setupCharts()
 
@@ -88,7 +90,10 @@ class Training(_Module):
         self.updateClearPB()
 
     def updateProfilesGroup(self):
-        self.ui.delete_PB.setEnabled(self.currentTrained is not None)
+        # Profile can't change while training runs in the background
+        self.ui.profile_CB.setEnabled(not self.isTraining)
+        self.ui.new_PB.setEnabled(not self.isTraining)
+        self.ui.delete_PB.setEnabled(self.currentTrained is not None and not self.isTraining)
         active = self.currentTrained is not None and not self.currentTrained.isSet
         self.ui.dataset_CB.setEnabled(active)
         self.ui.features_CB.setEnabled(active)
@@ -103,7 +108,7 @@ class Training(_Module):
         for cb in [self.ui.dataset_CB, self.ui.features_CB, self.ui.model_CB]:
             active = active and cb.count() > 0
         self.ui.sets_Group.setEnabled(active)
-        self.ui.set_PB.setEnabled(active)
+        self.ui.set_PB.setEnabled(active and not self.isTraining)
         if not active:
             return
         editable = active and not self.currentTrained.isSet
@@ -120,7 +125,7 @@ class Training(_Module):
 
     def updateClearPB(self):
         active =  self.currentTrained is not None
-        active = active and self.currentTrained.isTrained
+        active = active and self.currentTrained.isTrained and not self.isTraining
         self.ui.clear_PB.setEnabled(active)
 
     def populateDataset(self):
@@ -212,8 +217,6 @@ class Training(_Module):
         self.isTraining = True
         self.updateUI()
         self.train()
-        self.isTraining = False
-        self.updateUI()
 
     def onStopClicked(self):
         self.trainingSession.stopTraining()
@@ -225,7 +228,6 @@ class Training(_Module):
 
     def updateState(self, msg: str):
         self.ui.state_Label.setText(msg)
-        QtWidgets.QApplication.instance().processEvents()
 
     def loadGraphFromLog(self):
         with open(self.currentTrained.logFilePath, 'r') as f:
@@ -272,61 +274,71 @@ class Training(_Module):
     ########################################################################
 
     def train(self):
-        # Training session
+        """ Start training in a background thread """
         if self.trainingSession is None:
-            if self.currentTrained.hasModel:
-                model = loadModel(self.currentTrained.trainedModelPath)
-            else:
-                self.updateState("Creating neural net")
-                model = self.currentTrained.model.toKerasModel(self.currentTrained.features.feature_shape, len(self.project.keywords))
-                saveModel(model, self.currentTrained.trainedModelPath)
-                self.currentTrained.hasModel = True
-            self.trainingSession = TrainingSession(model, self.currentTrained.epoch)
+            self.trainingSession = TrainingSession(None, self.currentTrained.epoch)
+        # Reset before the thread starts so a stop clicked right after is not lost
+        self.trainingSession.stopRequested = False
 
         # Set charts ranges
         self.accChart.setRangeX(0, self.trainingSession.epoch + self.ui.epoch_SB.value())
         self.lossChart.setRangeX(0, self.trainingSession.epoch + self.ui.epoch_SB.value())
 
-        # Fetch sets
-        trainSet = DataSet()
-        trainSet.loadDataSet(self.currentTrained.trainSetPath)
-
-        valSet = DataSet()
-        valSet.loadDataSet(self.currentTrained.valSetPath)
-
-        # prepare inputs / outputs
-        train_input, train_output = prepare_input_output([trainSet], 
-                                                        self.currentTrained.features, 
-                                                        traceCallBack=self.updateState, 
-                                                        save_features_folder=self.currentTrained.featureFolder)
-        val_input, val_output = prepare_input_output([valSet],
-                                                     self.currentTrained.features, 
-                                                     traceCallBack=self.updateState,
-                                                     save_features_folder=self.currentTrained.featureFolder)
-        
-        # Set callbacks
-        callbacks = callbacksDef(self.currentTrained.trainedModelPath, self.train_callback)
-
-        # training
-        self.trainingSession.model.fit(train_input, 
-                                        train_output,
-                                        batch_size=self.ui.batch_SB.value(),
-                                        initial_epoch=self.trainingSession.epoch,
-                                        epochs= self.trainingSession.epoch + self.ui.epoch_SB.value() + 1,
-                                        callbacks=callbacks,
-                                        validation_data=(val_input,val_output),
-                                        verbose=0,
-                                        shuffle=self.ui.shuffle_CB.isChecked())
-
+        self.trainingWorker = TrainingWorker(self.currentTrained, 
+                                             self.trainingSession, 
+                                             len(self.project.keywords), 
+                                             self.ui.epoch_SB.value(), 
+                                             self.ui.batch_SB.value(), 
+                                             self.ui.shuffle_CB.isChecked(), 
+                                             streamInput=self.streamInput)
+        self.trainingThread = QtCore.QThread()
+        self.trainingWorker.moveToThread(self.trainingThread)
+        self.trainingWorker.state_changed.connect(self.updateState)
+        self.trainingWorker.epoch_ended.connect(self.train_callback)
+        self.trainingWorker.finished.connect(self.onTrainingFinished)
+        self.trainingWorker.stopped.connect(self.onTrainingStopped)
+        self.trainingWorker.failed.connect(self.onTrainingFailed)
+        self.trainingThread.started.connect(self.trainingWorker.run)
+        self.trainingThread.start()
+
+    def onTrainingFinished(self):
+        self.stopThread()
         self.currentTrained.isTrained = True
-        self.currentTrained.writeTrained()
-        self.project.trained_updated.emit()
         self.currentTrained.epoch = self.trainingSession.epoch
         self.currentTrained.writeTrained()
+        self.project.trained_updated.emit()
+        self.updateState("Idle")
 
         # Write training logs
         self.writeLogs()
 
+    def onTrainingStopped(self):
+        """ Training stopped before any epoch ended, the profile keeps its previous trained state """
+        self.stopThread()
+        self.currentTrained.writeTrained()
+        self.updateState("Idle")
+
+    def onTrainingFailed(self, msg: str):
+        self.stopThread()
+        self.currentTrained.writeTrained()
+        self.updateState("Training failed: {}".format(msg))
+
+    def teardown(self):
+        """ Stop training and wait for the training thread """
+        if self.trainingThread is not None:
+            self.trainingSession.stopTraining()
+            self.stopThread()
+
+    def stopThread(self):
+        if self.trainingThread is None: # Already stopped by teardown
+            return
+        self.trainingThread.quit()
+        self.trainingThread.wait()
+        self.trainingThread = None
+        self.trainingWorker = None
+        self.isTraining = False
+        self.updateUI()
+
     def train_callback(self, epoch, logs = {}):
         """ Called during training at the end of each epoch"""
         self.ui.state_Label.setText("Training (Epoch {} / {})...".format(epoch, "x"))
@@ -339,8 +351,6 @@ class Training(_Module):
             #self.model.stop_training = True
             #self.update_graph_range()
 
-        QtWidgets.QApplication.instance().processEvents() # Refresh UI
-
     def writeLogs(self):
         acc_values = self.accChart.getValues()
         loss_values = self.lossChart.getValues()
@@ -27,7 +27,8 @@ class Navigation(QtWidgets.QWidget):
         self.populate()
 
         # CONNECT
-        self.ui.close_PB.clicked.connect(self.project_closed.emit)
+        self.ui.close_PB.clicked.connect(self.onCloseClicked)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.teardownModules)
 
     def populate(self):
         for category in [self.ui.preparationWidget, self.ui.processingWidget, self.ui.outputWidget]:
@@ -54,4 +55,9 @@ class Navigation(QtWidgets.QWidget):
             self.instanciedModules.append(instance)
 
     def onCloseClicked(self):
-        pass
\ No newline at end of file
+        self.teardownModules()
+        self.project_closed.emit()
+
+    def teardownModules(self):
+        for module in self.instanciedModules:
+            module.teardown()
\ No newline at end of file
@@ -0,0 +1,119 @@
+from PyQt5 import QtChart, QtWidgets, QtGui, QtCore
+
+import numpy as np
+
+class DetectionChart(QtWidgets.QWidget):
+    """ ROC / DET curves with the operating point at the current threshold.
+
+    Clicking on the curve picks the threshold of the nearest point (thresholdPicked signal).
+    """
+    thresholdPicked = QtCore.pyqtSignal(float)
+    modes = ["ROC", "DET"]
+    max_points = 2000 # Displayed points, curves are subsampled above
+
+    def __init__(self):
+        QtWidgets.QWidget.__init__(self)
+        self.layout = QtWidgets.QVBoxLayout()
+        self.mode_CB = QtWidgets.QComboBox()
+        self.mode_CB.addItems(DetectionChart.modes)
+        self.chart = QtChart.QChart()
+        self.chart.legend().hide()
+        self.chartView = QtChart.QChartView(self.chart)
+        self.chartView.setRenderHint(QtGui.QPainter.Antialiasing)
+        self.layout.addWidget(self.mode_CB)
+        self.layout.addWidget(self.chartView)
+        self.setLayout(self.layout)
+
+        self.curve = QtChart.QLineSeries()
+        self.point = QtChart.QScatterSeries()
+        self.point.setMarkerSize(10)
+        self.point.setColor(QtGui.QColor("red"))
+        self.chart.addSeries(self.curve)
+        self.chart.addSeries(self.point)
+
+        self.thresholds = np.array([]) # Decreasing
+        self.fpr = np.array([])
+        self.fnr = np.array([])
+        self.threshold = None
+        self.setMode(DetectionChart.modes[0])
+
+        self.mode_CB.currentTextChanged.connect(self.setMode)
+        self.curve.clicked.connect(self.onCurveClicked)
+
+    def load(self, thresholds: np.ndarray, fpr: np.ndarray, fnr: np.ndarray):
+        """ Set the curves (see processing.metrics.ThresholdSweep.curves) """
+        if len(thresholds) > DetectionChart.max_points:
+            kept = np.unique(np.linspace(0, len(thresholds) - 1, DetectionChart.max_points).astype(int))
+            thresholds, fpr, fnr = thresholds[kept], fpr[kept], fnr[kept]
+        self.thresholds, self.fpr, self.fnr = thresholds, fpr, fnr
+        self.updateCurve()
+
+    def clear(self):
+        self.load(np.array([]), np.array([]), np.array([]))
+        self.threshold = None
+        self.point.clear()
+
+    def setMode(self, mode: str):
+        self.mode = mode
+        self.curve.clear() # Points of the previous mode may not fit the new axes
+        self.point.clear()
+        for axis in self.chart.axes():
+            self.chart.removeAxis(axis)
+        if mode == "ROC":
+            axisX, axisY = QtChart.QValueAxis(), QtChart.QValueAxis()
+            axisX.setRange(0, 1)
+            axisY.setRange(0, 1)
+            axisY.setTitleText("True positive rate")
+        else:
+            axisX, axisY = QtChart.QLogValueAxis(), QtChart.QLogValueAxis()
+            for axis in [axisX, axisY]:
+                axis.setLabelFormat("%g")
+            axisY.setTitleText("False negative rate")
+        axisX.setTitleText("False positive rate")
+        self.chart.addAxis(axisX, QtCore.Qt.AlignBottom)
+        self.chart.addAxis(axisY, QtCore.Qt.AlignLeft)
+        for serie in [self.curve, self.point]:
+            serie.attachAxis(axisX)
+            serie.attachAxis(axisY)
+        self.updateCurve()
+
+    def coordinates(self, fpr: np.ndarray, fnr: np.ndarray) -> tuple:
+        if self.mode == "ROC":
+            return fpr, 1.0 - fnr
+        floor = self.logFloor()
+        return np.maximum(fpr, floor), np.maximum(fnr, floor) # Rates at 0 can't be displayed on log axes
+
+    def logFloor(self) -> float:
+        nonZero = np.concatenate([self.fpr[self.fpr > 0], self.fnr[self.fnr > 0]])
+        return min(np.min(nonZero) / 2, 0.1) if len(nonZero) > 0 else 1e-3
+
+    def updateCurve(self):
+        x, y = self.coordinates(self.fpr, self.fnr)
+        self.curve.replace([QtCore.QPointF(a, b) for a, b in zip(x, y)])
+        if self.mode == "DET":
+            floor = self.logFloor()
+            for axis in self.chart.axes():
+                axis.setRange(floor, 1)
+        if self.threshold is not None:
+            self.setOperatingPoint(self.threshold)
+
+    def setOperatingPoint(self, threshold: float):
+        """ Move the marker to the curve point at threshold """
+        self.threshold = threshold
+        self.point.clear()
+        if len(self.thresholds) == 0:
+            return
+        i = np.searchsorted(-self.thresholds[1:], -threshold, side='right') # Last point whose threshold is above
+        x, y = self.coordinates(self.fpr[i:i+1], self.fnr[i:i+1])
+        self.point.append(x[0], y[0])
+
+    def onCurveClicked(self, point: QtCore.QPointF):
+        if len(self.thresholds) == 0:
+            return
+        x, y = self.coordinates(self.fpr, self.fnr)
+        if self.mode == "DET":
+            x, y, px, py = np.log10(x), np.log10(y), np.log10(max(point.x(), 1e-12)), np.log10(max(point.y(), 1e-12))
+        else:
+            px, py = point.x(), point.y()
+        i = int(np.argmin((x - px) ** 2 + (y - py) ** 2))
+        self.thresholdPicked.emit(float(self.thresholds[i]))
@@ -1,8 +1,6 @@
 from PyQt5 import QtWidgets, QtCore
 from base import Project, _Feature
 
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
 from processing.files_to_feats import files_to_feat
 from interfaces.utils.qtutils import empty_layout
 import numpy as np
@@ -18,6 +16,8 @@ class Feature_Chart(QtWidgets.QWidget):
         empty_layout(self.layout)
 
     def createGraph(self, dataSet, feature_param : _Feature, display_variance):
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
         empty_layout(self.layout)
         self.figure = Figure()
         self.figure.clear()
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import sys
+import time
+
+START_TIME = time.perf_counter()
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -10,7 +13,14 @@ def main():
     app = QtWidgets.QApplication(sys.argv)
     mainWindow = MainWindow()
     mainWindow.show()
+    if "--startup-time" in sys.argv:
+        QtCore.QTimer.singleShot(0, lambda: reportStartupTime(app))
     sys.exit(app.exec_())
 
+def reportStartupTime(app):
+    """ Print the time to first window (module imports included) and quit """
+    print("Time to first window: {:.3f}s".format(time.perf_counter() - START_TIME))
+    app.quit()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,11 +1,9 @@
 import os
 
-import tensorflowjs as tfjs
-
 from base.model import _Model, _Layer, GRU_Layer
-from .keras_utils import loadModel
-from tensorflow.keras.models import save_model
-from tensorflow import lite as tflite
+
+# tensorflow and tensorflowjs are imported on first export
+
 def isTFLiteCompatible(model: _Model) -> tuple:
     for layer in model.layers:
         if type(layer) is GRU_Layer:
@@ -20,21 +18,31 @@ def isTFJSCompatible(model: _Model) -> tuple:
                 return (False, "TFJS models need the GRU flag reset_after set to True.")
     return (True, "")
 
-def exportTFLite(modelPath: str, targetPath: str):
-    model = loadModel(modelPath)
+def toTFLite(model) -> bytes:
+    """ Convert a keras model to a TFLite flatbuffer """
+    from tensorflow import lite as tflite
     try:
         converter = tflite.TFLiteConverter.from_keras_model(model)
-        tf_lite_model = converter.convert()
-        with open(targetPath, 'wb') as f:
-            f.write(tf_lite_model)
+        return converter.convert()
     except Exception as e:
         raise Exception("Failed to export to TFLile format : {}".format(e))
 
+def exportTFLite(modelPath: str, targetPath: str):
+    from .keras_utils import loadModel
+    model = loadModel(modelPath)
+    tf_lite_model = toTFLite(model)
+    with open(targetPath, 'wb') as f:
+        f.write(tf_lite_model)
+
 def exportKeras(modelPath: str, targetPath: str):
+    from tensorflow.keras.models import save_model
+    from .keras_utils import loadModel
     model = loadModel(modelPath)
     save_model(model, targetPath)
 
 def exportTFJS(modelPath, targetFolder):
+    import tensorflowjs as tfjs
+    from .keras_utils import loadModel
     if not os.path.isdir(targetFolder):
         try:
             os.mkdir(targetFolder)
@@ -0,0 +1,326 @@
+import os
+import json
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+def sampleKey(filePath: str) -> str:
+    """ Cache key of an audio file: absolute path, modification time and size """
+    stat = os.stat(filePath)
+    return "{}:{}:{}".format(os.path.abspath(filePath), stat.st_mtime_ns, stat.st_size)
+
+def toPCM(signal: np.ndarray) -> np.ndarray:
+    """ Convert a [-1, 1] float signal to int16 PCM """
+    return np.clip(np.round(signal * 32768.0), -32768, 32767).astype('<i2')
+
+def fromPCM(pcm: np.ndarray) -> np.ndarray:
+    """ Convert int16 PCM to a [-1, 1] float32 signal """
+    return pcm.astype(np.float32) / 32768.0
+
+class StoreLock:
+    """ Exclusive lock on a lock file, shared by threads and processes (context manager) """
+    def __init__(self, lockPath: str):
+        self.lockPath = lockPath
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.lockPath, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # LK_LOCK gives up after 10 seconds
+                    continue
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+class _AppendStore:
+    """ Data file indexed by key, shared by the stores opened on the same folder in any thread or process.
+
+    Data is appended to dataFileName by units of unitSize bytes. The index (key -> location) and the number of units
+    (countName) are written in indexFileName. Each append writes its data, then appends a line {"index": {key: location}, countName: n}
+    to the index journal: the chunks written before an interrupted extraction are kept.
+    The journal is merged into the index file (written to a temporary file, then renamed) once it outgrows it.
+
+    Appends hold the store lock file. The appending store first reads the index entries written by the other stores:
+    data beyond the last indexed unit is then an interrupted append, it is only truncated there.
+    """
+    dataFileName = ""
+    indexFileName = "index.json"
+    journalFileName = "index.journal"
+    lockFileName = "lock"
+    countName = "n_units"
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.loadIndex()
+
+    @property
+    def unitSize(self) -> int:
+        raise NotImplementedError()
+
+    def header(self) -> dict:
+        """ Store parameters written in the index """
+        return dict()
+
+    def loadIndex(self):
+        """ Load the index and its journal. Drop the store content if it was written with other parameters """
+        self.readIndex()
+        if not self.isConsistent():
+            with self.lock():
+                self.readIndex()
+                if not self.isConsistent():
+                    self.clear()
+
+    def isConsistent(self) -> bool:
+        """ The index is readable and the data of every indexed unit is in the data file (it may have been removed or damaged) """
+        data_size = os.path.getsize(self.dataPath) if os.path.isfile(self.dataPath) else 0
+        return not self.dropped and data_size >= self.n_units * self.unitSize
+
+    def readIndex(self):
+        self.index = dict() # key -> location
+        self.n_units = 0
+        self.indexState = self.fileState(self.indexPath)
+        self.journalOffset = 0 # Journal bytes applied to the index
+        self.dropped = False # Index unreadable or written with other parameters
+        if self.indexState is not None:
+            try:
+                with open(self.indexPath, 'r') as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                print("Could not read index {}: {}".format(self.indexPath, e))
+                manifest = None
+            if manifest is not None and self.countName in manifest and all([manifest.get(k) == v for k, v in self.header().items()]):
+                self.index = manifest["index"]
+                self.n_units = manifest[self.countName]
+            else:
+                self.dropped = True
+                return
+        self.replayJournal()
+
+    def replayJournal(self):
+        """ Apply the journal entries written since the last read """
+        if not os.path.isfile(self.journalPath):
+            return
+        with open(self.journalPath, 'rb') as f:
+            f.seek(self.journalOffset)
+            content = f.read()
+        end = content.rfind(b"\n") + 1 # An incomplete last line is being written
+        for line in content[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Interrupted write
+            self.index.update(entry["index"])
+            self.n_units = max(self.n_units, entry[self.countName])
+        self.journalOffset += end
+
+    def refresh(self):
+        """ Read the index entries written by other stores, must be called holding the lock """
+        if self.fileState(self.indexPath) != self.indexState:
+            self.readIndex() # Journal merged into the index
+        else:
+            self.replayJournal()
+        if not self.isConsistent():
+            self.clear()
+
+    def appendData(self, index: dict, data: list):
+        """ Append data (list of arrays of whole units), index holds the key of each array and its location
+        relative to the first appended unit (see storeLocation)
+        """
+        with self.lock():
+            self.refresh()
+            data_size = os.path.getsize(self.dataPath) if os.path.isfile(self.dataPath) else 0
+            if data_size > self.n_units * self.unitSize: # Interrupted append
+                with open(self.dataPath, 'r+b') as f:
+                    f.truncate(self.n_units * self.unitSize)
+            with open(self.dataPath, 'ab') as f:
+                for array in data:
+                    array.tofile(f)
+            index = {key: self.storeLocation(self.n_units, loc) for key, loc in index.items()}
+            self.n_units += sum([array.nbytes for array in data]) // self.unitSize
+            self.index.update(index)
+            line = json.dumps({"index": index, self.countName: self.n_units}) + "\n"
+            if self.journalOffset != (os.path.getsize(self.journalPath) if os.path.isfile(self.journalPath) else 0):
+                line = "\n" + line # Interrupted journal write, don't append to the invalid entry
+            with open(self.journalPath, 'a') as f:
+                f.write(line)
+            self.journalOffset = os.path.getsize(self.journalPath)
+            if self.journalOffset > (self.indexState[1] if self.indexState is not None else 0):
+                self.writeIndex()
+
+    def storeLocation(self, start: int, loc):
+        """ Location of an appended array starting at unit start, loc being its location relative to the append """
+        return start + loc
+
+    def writeIndex(self):
+        """ Merge the journal into the index file, must be called holding the lock """
+        manifest = self.header()
+        manifest[self.countName] = self.n_units
+        manifest["index"] = self.index
+        with open(self.indexPath + ".tmp", 'w') as f:
+            f.write(json.dumps(manifest))
+        os.replace(self.indexPath + ".tmp", self.indexPath)
+        if os.path.isfile(self.journalPath):
+            os.remove(self.journalPath)
+        self.indexState = self.fileState(self.indexPath)
+        self.journalOffset = 0
+
+    def clear(self):
+        self.index = dict()
+        self.n_units = 0
+        for path in [self.dataPath, self.indexPath, self.journalPath]:
+            if os.path.isfile(path):
+                os.remove(path)
+        self.indexState = None
+        self.journalOffset = 0
+        self.dropped = False
+
+    def lock(self) -> StoreLock:
+        return StoreLock(os.path.join(self.folder, self.lockFileName))
+
+    @staticmethod
+    def fileState(path: str) -> tuple:
+        """ Identity of a file version (inode, modification time, size), None if it doesn't exist """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def dataPath(self) -> str:
+        return os.path.join(self.folder, self.dataFileName)
+
+    @property
+    def indexPath(self) -> str:
+        return os.path.join(self.folder, self.indexFileName)
+
+    @property
+    def journalPath(self) -> str:
+        return os.path.join(self.folder, self.journalFileName)
+
+class FeatureStore(_AppendStore):
+    """ Contiguous on-disk feature matrix.
+
+    Features rows are appended to a single binary file and indexed by key (sample file).
+    The whole matrix is read back through a memory map.
+    """
+    dataFileName = "features.bin"
+    countName = "n_rows"
+
+    def __init__(self, folder: str, feature_shape: tuple, dtype: str = "float64"):
+        self.feature_shape = tuple(feature_shape)
+        self.dtype = np.dtype(dtype)
+        _AppendStore.__init__(self, folder)
+
+    def header(self) -> dict:
+        return {"shape": list(self.feature_shape), "dtype": self.dtype.name}
+
+    def append(self, keys: list, features: np.ndarray):
+        """ Append features (len(keys), *feature_shape) to the store. Existing keys point to the new rows. """
+        features = np.ascontiguousarray(features, dtype=self.dtype)
+        if features.shape != (len(keys),) + self.feature_shape:
+            raise Exception("Features shape {} doesn't match store shape {}".format(features.shape, self.feature_shape))
+        self.appendData({key: i for i, key in enumerate(keys)}, [features])
+
+    def matrix(self) -> np.ndarray:
+        """ Return the whole feature matrix as a read-only memory map """
+        if self.n_rows == 0:
+            return np.zeros((0,) + self.feature_shape, dtype=self.dtype)
+        return np.memmap(self.dataPath, dtype=self.dtype, mode='r', shape=(self.n_rows,) + self.feature_shape)
+
+    def rows(self, keys: list) -> np.ndarray:
+        return np.array([self.index[key] for key in keys], dtype=np.int64)
+
+    def getFeatures(self, keys: list) -> np.ndarray:
+        """ Return features for keys. Consecutive rows are returned as a view of the memory map, other selections are copied. """
+        rows = self.rows(keys)
+        matrix = self.matrix()
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            return matrix[rows[0] : rows[-1] + 1]
+        return matrix[rows]
+
+    @property
+    def n_rows(self) -> int:
+        return self.n_units
+
+    @property
+    def unitSize(self) -> int:
+        return self.rowSize
+
+    @property
+    def rowSize(self) -> int:
+        return int(np.prod(self.feature_shape)) * self.dtype.itemsize
+
+class AudioCache(_AppendStore):
+    """ Decoded audio cache.
+
+    Signals decoded and resampled at sample_rate are stored once as int16 PCM, appended to a single file and indexed by key (sampleKey).
+    WAV files already in that format are read directly (see files_to_feats.read_wav_pcm16), they are not cached.
+    """
+    dataFileName = "audio.pcm"
+    countName = "n_samples"
+
+    def __init__(self, folder: str, sample_rate: int):
+        self.sample_rate = sample_rate
+        _AppendStore.__init__(self, os.path.join(folder, str(sample_rate))) # index: key -> (offset, length) in samples
+
+    def header(self) -> dict:
+        return {"sample_rate": self.sample_rate}
+
+    def append(self, keys: list, signals: list):
+        """ Append int16 PCM signals """
+        signals = [np.ascontiguousarray(pcm, dtype='<i2') for pcm in signals]
+        offsets = np.cumsum([0] + [len(pcm) for pcm in signals[:-1]])
+        self.appendData({key: (int(offset), len(pcm)) for key, offset, pcm in zip(keys, offsets, signals)}, signals)
+
+    def storeLocation(self, start: int, loc) -> tuple:
+        return (start + loc[0], loc[1])
+
+    def location(self, key: str) -> tuple:
+        """ Return (data file, offset, length) of a cached signal, None if not cached """
+        if key not in self.index:
+            return None
+        offset, length = self.index[key]
+        return (self.dataPath, offset, length)
+
+    def getPCM(self, key: str) -> np.ndarray:
+        return AudioCache.readPCM(*self.location(key))
+
+    @staticmethod
+    def readPCM(dataPath: str, offset: int, length: int) -> np.ndarray:
+        return np.fromfile(dataPath, dtype='<i2', count=length, offset=offset * 2)
+
+    @property
+    def n_samples(self) -> int:
+        return self.n_units
+
+    @property
+    def unitSize(self) -> int:
+        return 2
@@ -1,23 +1,89 @@
 import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
-from librosa import load as loadAudio
 from base import _Feature
 from base import DataSet
+from processing.feature_store import FeatureStore, AudioCache, sampleKey, toPCM, fromPCM
 
-def file_to_feat(filePath: str, feat_param : _Feature, autoTrim: bool = True, zeroPadding: bool = True):
-    data = loadAudio(filePath, sr=feat_param.sample_rate)[0]
+def read_wav_pcm16(filePath: str, sample_rate: int) -> np.ndarray:
+    """ Memory-map the PCM payload of a mono 16 bits WAV file sampled at sample_rate.
+    Returns None if the file is not a WAV file in that exact format.
+    """
+    with open(filePath, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                if len(fmt) < 16:
+                    return None
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    if fmt is None:
+        return None
+    audio_format, n_channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if audio_format == 0xFFFE and len(fmt) >= 26: # WAVE_FORMAT_EXTENSIBLE: format is the first field of the sub-format GUID
+        audio_format = struct.unpack('<H', fmt[24:26])[0]
+    if audio_format != 1 or n_channels != 1 or bits != 16 or rate != sample_rate:
+        return None
+    n_samples = min(chunk_size, os.path.getsize(filePath) - data_offset) // 2 # Size may be wrong on streamed files
+    if n_samples == 0:
+        return np.zeros(0, dtype='<i2')
+    return np.memmap(filePath, dtype='<i2', mode='r', offset=data_offset, shape=(n_samples,))
+
+def decode_pcm(filePath: str, sample_rate: int) -> np.ndarray:
+    """ Decode an audio file to int16 PCM resampled to sample_rate """
+    pcm = read_wav_pcm16(filePath, sample_rate)
+    if pcm is not None:
+        return pcm
+    return toPCM(load_resampled(filePath, sample_rate))
+
+def decode_audio(filePath: str, sample_rate: int) -> np.ndarray:
+    """ Decode an audio file resampled to sample_rate, as a float signal.
+    WAV files already in the target format are read directly, others are decoded and resampled by librosa.
+    """
+    pcm = read_wav_pcm16(filePath, sample_rate)
+    if pcm is not None:
+        return fromPCM(pcm)
+    return load_resampled(filePath, sample_rate)
 
+def load_resampled(filePath: str, sample_rate: int) -> np.ndarray:
+    """ Decode and resample an audio file with librosa """
+    from librosa import load as loadAudio
+    return loadAudio(filePath, sr=sample_rate)[0]
+
+def fit_sample(data: np.ndarray, feat_param : _Feature, autoTrim: bool = True, zeroPadding: bool = True, filePath: str = "") -> np.ndarray:
+    """ Trim / pad a signal to feat_param.sample_s """
     if len(data) > feat_param.sample_s and autoTrim: # Trim longer sample (centered)
-        excess = len(data) - feat_param.sample_s
-        data = data[excess // 2 : -(excess //2)]
+        start = (len(data) - feat_param.sample_s) // 2
+        data = data[start : start + feat_param.sample_s]
     elif len(data) < feat_param.sample_s: # Zero-pad short sample (centered)
         if zeroPadding:
             lack = feat_param.sample_s - len(data)
-            data = np.concatenate([np.zeros(lack // 2), data, np.zeros(lack // 2 + 1)])
+            data = np.concatenate([np.zeros(lack // 2, dtype=data.dtype), data, np.zeros(lack - lack // 2, dtype=data.dtype)])
         else:
             raise Exception("{} : Sample too short ({}/{})".format(filePath, len(data), feat_param.sample_s))
+    return data
+
+def load_sample(filePath: str, feat_param : _Feature, autoTrim: bool = True, zeroPadding: bool = True) -> np.ndarray:
+    """ Load an audio file at the feature sample rate and trim / pad it to feat_param.sample_s """
+    return fit_sample(decode_audio(filePath, feat_param.sample_rate), feat_param, autoTrim, zeroPadding, filePath)
 
-    return feat_param.extract_function(data)
+def file_to_feat(filePath: str, feat_param : _Feature, autoTrim: bool = True, zeroPadding: bool = True):
+    return feat_param.extract_function(load_sample(filePath, feat_param, autoTrim, zeroPadding))
 
 def files_to_feat(file_list: list, feat_param : _Feature, autoTrim: bool = True, zeroPadding: bool = True):
     features = []
@@ -40,65 +106,140 @@ def createOutputs(labels: list) -> dict:
         outputFormat[label] = arr
     return outputFormat
 
-def prepare_input_output(datasets: list, features: _Feature, save_features_folder: str = None, traceCallBack = None, returnSamples: bool = False) -> tuple:
-    """ Generate input / output from a dataset """
+def extract_files(file_list: list, feat_param : _Feature, cached_audio: list = None) -> list:
+    """ Decode and extract features from a list of files.
+
+    If cached_audio is set, it holds for each file the AudioCache location of its decoded PCM, None if it is not cached yet.
+    Signals are then read from the cache, read directly from WAV files already in the features format or decoded to PCM.
+
+    Returns a list of (features, pcm) aligned with file_list. features is None for files that failed, 
+    pcm is the PCM decoded by librosa in this call for files missing from the audio cache, None otherwise: reading 
+    WAV files in the features format costs as much as reading the cache, they are not copied to it.
+    """
+    features = [None] * len(file_list)
+    decoded = [None] * len(file_list)
+    for i, f in enumerate(file_list):
+        try:
+            if cached_audio is None:
+                data = decode_audio(f, feat_param.sample_rate)
+            elif cached_audio[i] is not None:
+                data = fromPCM(AudioCache.readPCM(*cached_audio[i]))
+            else:
+                pcm = read_wav_pcm16(f, feat_param.sample_rate)
+                if pcm is None:
+                    pcm = decoded[i] = toPCM(load_resampled(f, feat_param.sample_rate))
+                data = fromPCM(pcm)
+            features[i] = feat_param.extract_function(fit_sample(data, feat_param, filePath=f))
+        except Exception as e:
+            print("Failed to extract parameter from {}: {}".format(f, e))
+    return list(zip(features, decoded))
+
+def collect_features(datasets: list, features: _Feature, store: FeatureStore = None, audioCache: AudioCache = None, traceCallBack = None,
+                     n_workers: int = 1, chunk_size: int = 64) -> tuple:
+    """ Extract the features of every dataset sample missing from store.
+
+    Samples without saved features are split into chunks of chunk_size files, decoded and extracted by n_workers processes 
+    (in the calling process if n_workers is 1). Results are collected in order.
+    Extracted features are appended to store chunk by chunk if it is set (an interrupted extraction keeps the chunks already
+    appended), otherwise they are returned.
+
+    Returns (samples, keys, outputs, extracted) for the samples whose features are available, keys being their store keys 
+    and extracted the list of their features (None when using a store).
+    """
     labels = createOutputs(datasets[0].labels)
-    save_feature = save_features_folder is not None
-    inputs = []
+    extracted = dict() # Features by sample index, when there is no feature store
+    available = [] # Whether features are available for each sample
     outputs = []
     samples = []
+    keys = [] # Feature cache keys
     n_sample = sum([len(dataset.samples) for dataset in datasets])
-    for dataset in datasets:
-        for i, sample in enumerate(dataset.samples):
-            try:
-                if sample.featureFile is not None:
-                    try:
-                        feats = loadFeatureFile(sample.featureFile, features.feature_shape)
-                    except Exception as e:
-                        feats = file_to_feat(sample.file, features)
-                        sample.featureFile = None
-                else:
-                    feats = file_to_feat(sample.file, features)
-                    if save_feature:
-                        featFile = os.path.join(save_features_folder, os.path.basename(sample.file) + ".feat")
-                        sample.featureFile = featFile
-                        try:
-                            writeFeatureFile(featFile, feats)
-                        except Exception as e:
-                            print(e)
-            except Exception as e:
-                print("Failed to extract parameter from {}: {}".format(sample.file, e))
-                continue
-            else:
+    n_done = 0
+
+    executor = ProcessPoolExecutor(n_workers) if n_workers > 1 else None
+    mapFun = executor.map if executor is not None else map
+    try:
+        for dataset in datasets:
+            missing = [] # Index of samples without saved features
+            for sample in dataset.samples:
                 try:
-                    inputs.append(feats)
+                    key = sampleKey(sample.file) if store is not None or audioCache is not None else sample.file
                 except Exception as e:
-                    print(e)
+                    print("Failed to extract parameter from {}: {}".format(sample.file, e))
+                    continue
+                found = store is not None and key in store
+                if found:
+                    n_done += 1
+                else:
+                    missing.append(len(samples))
+                available.append(found)
                 outputs.append(labels[sample.label])
-                if returnSamples:
-                    samples.append(sample)
-            if traceCallBack is not None:
-                traceCallBack("Extracting features from {}: {}/{}".format(dataset.dataSetName, i, n_sample))
+                samples.append(sample)
+                keys.append(key)
+
+            chunks = [missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            cached_audio = repeat(None)
+            if audioCache is not None:
+                cached_audio = [[audioCache.location(keys[i]) for i in chunk] for chunk in chunks]
+            results = mapFun(extract_files, [[samples[i].file for i in chunk] for chunk in chunks], repeat(features), cached_audio)
+            for chunk, chunk_results in zip(chunks, results):
+                if audioCache is not None:
+                    decoded = [(i, pcm) for i, (_, pcm) in zip(chunk, chunk_results) if pcm is not None]
+                    if len(decoded) > 0:
+                        audioCache.append([keys[i] for i, _ in decoded], [pcm for _, pcm in decoded])
+                chunk_feats = [(i, feats) for i, (feats, _) in zip(chunk, chunk_results) if feats is not None]
+                for i, feats in chunk_feats:
+                    available[i] = True
+                    if store is None:
+                        extracted[i] = feats
+                if store is not None and len(chunk_feats) > 0:
+                    store.append([keys[i] for i, _ in chunk_feats], np.array([feats for _, feats in chunk_feats]))
+                n_done += len(chunk)
+                if traceCallBack is not None:
+                    traceCallBack("Extracting features from {}: {}/{}".format(dataset.dataSetName, n_done, n_sample))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True) # Interrupted extraction: drop the chunks not started
+
+    # Drop samples which failed at extraction
+    kept = [i for i, found in enumerate(available) if found]
+    return ([samples[i] for i in kept], 
+            [keys[i] for i in kept], 
+            np.array([outputs[i] for i in kept]), 
+            [extracted[i] for i in kept] if store is None else None)
+
+def prepare_feature_store(datasets: list, features: _Feature, save_features_folder: str, traceCallBack = None,
+                          n_workers: int = 1, chunk_size: int = 64, audio_cache_folder: str = None) -> tuple:
+    """ Make sure the features of every dataset sample are in the feature cache, without loading them.
 
-        if save_features_folder is not None:
-            if dataset.datasetFile is not None and dataset.datasetFile != "":
-                dataset.saveDataSet()
+    save_features_folder is the feature cache shared by every features profile: features are kept in a FeatureStore
+    in a sub-folder named after the features digest, keyed by sampleKey.
+    If audio_cache_folder is set, decoded signals are kept in an AudioCache so that features profiles with the same sample rate
+    skip decoding and resampling.
 
-    inputs = np.array(inputs)
-    outputs = np.array(outputs)
+    Returns (store, samples, keys, outputs) for the samples whose features are available.
+    """
+    store = FeatureStore(os.path.join(save_features_folder, features.digest), features.feature_shape)
+    audioCache = AudioCache(audio_cache_folder, features.sample_rate) if audio_cache_folder is not None else None
+    samples, keys, outputs, _ = collect_features(datasets, features, store, audioCache, traceCallBack, n_workers, chunk_size)
+    return store, samples, keys, outputs
+
+def prepare_input_output(datasets: list, features: _Feature, save_features_folder: str = None, traceCallBack = None, returnSamples: bool = False, 
+                         n_workers: int = 1, chunk_size: int = 64, audio_cache_folder: str = None) -> tuple:
+    """ Generate input / output from a dataset.
+
+    If save_features_folder is set, features are kept in the feature cache (see prepare_feature_store) and inputs are read 
+    from its memory map.
+    """
+    if save_features_folder is not None:
+        store, samples, keys, outputs = prepare_feature_store(datasets, features, save_features_folder, traceCallBack,
+                                                              n_workers, chunk_size, audio_cache_folder)
+        inputs = store.getFeatures(keys)
+    else:
+        audioCache = AudioCache(audio_cache_folder, features.sample_rate) if audio_cache_folder is not None else None
+        samples, keys, outputs, extracted = collect_features(datasets, features, None, audioCache, traceCallBack, n_workers, chunk_size)
+        inputs = np.array(extracted)
     
     if returnSamples:
         return samples, inputs, outputs
     else:
         return inputs, outputs
-
-def writeFeatureFile(filePath: str, content: np.ndarray):
-    with open(filePath, 'bw') as f:
-        content.tofile(f)
-
-def loadFeatureFile(filePath :str, shape: tuple) -> np.array:
-    with open(filePath, 'br') as f:
-        feats = np.fromfile(f)
-    return feats.reshape(shape)
-
-
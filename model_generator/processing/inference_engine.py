@@ -3,18 +3,108 @@ import time
 from PyQt5 import QtCore
 
 import numpy as np
-import pyaudio
 
 from base import _Feature
-from processing.keras_utils import loadModel
-from processing.mfcc import mfcc_feats
+from base.model import _Model
+from processing.ring_buffer import RingBuffer
+from processing.streaming_model import StreamingModel
+
+class _Backend:
+    """ Runs a keras model on a batch of inputs """
+    name = None
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        pass
+
+class KerasBackend(_Backend):
+    """ keras model.predict, has a large per call overhead (batching, callbacks) """
+    name = "keras"
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return self.model.predict(x, verbose=0)
+
+class FunctionBackend(_Backend):
+    """ Direct model call traced once in a tf.function """
+    name = "function"
+    def __init__(self, model):
+        import tensorflow as tf
+        _Backend.__init__(self, model)
+        self.function = tf.function(lambda x: model(x, training=False), 
+                                    input_signature=[tf.TensorSpec(model.input_shape, tf.float32)])
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return self.function(np.asarray(x, dtype=np.float32)).numpy()
+
+class TFLiteBackend(_Backend):
+    """ TFLite interpreter running the model converted in memory (as exportTFLite). GRU layers must be unrolled. """
+    name = "tflite"
+    def __init__(self, model):
+        from tensorflow import lite as tflite
+        from processing.export import toTFLite
+        _Backend.__init__(self, model)
+        self.interpreter = tflite.Interpreter(model_content=toTFLite(model))
+        self.interpreter.allocate_tensors()
+        self.inputIndex = self.interpreter.get_input_details()[0]["index"]
+        self.outputIndex = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = self.interpreter.get_input_details()[0]["shape"][0]
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if len(x) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.inputIndex, x.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x)
+        self.interpreter.set_tensor(self.inputIndex, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.outputIndex)
+
+backends = {backend.name: backend for backend in [KerasBackend, FunctionBackend, TFLiteBackend]}
+
+def createBackend(name: str, model) -> _Backend:
+    if name not in backends.keys():
+        raise Exception("Unknown inference backend {}, expected one of {}".format(name, list(backends.keys())))
+    return backends[name](model)
+
+def benchmarkBackends(model, n_calls: int = 100, names: list = None) -> dict:
+    """ Measure single sample prediction latency of each backend on random inputs.
+
+    Returns a dict name: {"mean", "median", "p95", "max"} in milliseconds, or name: error message if the backend
+    could not be created (e.g. TFLite with a non unrolled GRU).
+    """
+    names = names if names is not None else list(backends.keys())
+    x = np.random.randn(1, *model.input_shape[1:]).astype(np.float32)
+    results = dict()
+    for name in names:
+        try:
+            backend = createBackend(name, model)
+        except Exception as e:
+            results[name] = str(e)
+            continue
+        for _ in range(3): # Warm up (tracing, allocations)
+            backend.predict(x)
+        latencies = []
+        for _ in range(n_calls):
+            start = time.perf_counter()
+            backend.predict(x)
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[name] = {"mean": float(np.mean(latencies)),
+                         "median": float(np.median(latencies)),
+                         "p95": float(np.percentile(latencies, 95)),
+                         "max": float(np.max(latencies))}
+    return results
 
 class InferenceEngine(QtCore.QObject):
 
     prediction = QtCore.pyqtSignal(float, list, name='project_updated') # On prediction emit (x_value, [predictions])
     sample_detected = QtCore.pyqtSignal(bytes, int, name='sample_detected') # On prediction emit (x_value, [predictions])
 
-    def __init__(self, features: _Feature, modelPath: str, threshold: float):
+    def __init__(self, features: _Feature, modelPath: str, threshold: float, modelDesc: _Model = None, streamingMode: str = None,
+                 backend: str = FunctionBackend.name):
+        """ If streamingMode is set ("continuous" or "windowed", see StreamingModel), the model built from modelDesc
+        is run one frame at a time instead of running the whole features window on each new frame.
+        backend is the name of the inference backend (see backends).
+        """
         QtCore.QObject.__init__(self)
         self.features = features
         self.threshold = threshold
@@ -22,23 +112,42 @@ class InferenceEngine(QtCore.QObject):
         self.isRunning = False
         self.audio = None
 
-        self.signalBuffer = None
-        self.featuresBuffer = None
-        self.currentSignal = b"" # Audio signal corresponding to features being infered
-        self.triggeringSignal = b""
+        self.featuresBuffer = RingBuffer(self.features.feature_shape[0], self.features.feature_shape[1:], dtype=np.float64) # Features window
+        self.currentSignal = RingBuffer(self.features.sample_s, dtype='<i2') # Audio signal corresponding to features being infered
+        self.frameBuffer = np.zeros(self.features.window_stride_s, dtype=np.float32) # Normalized audio hop
+        self.triggeringSignal = bytearray()
         self.timeStamp = 0.0
+        self.n_frames = 0 # Number of features frames extracted
+        self.lastFrameTime = 0.0 # Time spent buffering and extracting features on the last audio frame (s)
+        self.lastPredictionTime = 0.0 # Time spent on the last prediction (s)
 
         self.f_det = False
         self.f_cp = -1
 
+        from processing.keras_utils import loadModel
         self.model = loadModel(modelPath)
+        self.backend = None
+        self.streamingModel = None
+        if streamingMode is not None:
+            self.streamingModel = StreamingModel(modelDesc, self.model, self.features.feature_shape[0], streamingMode, backend=backend)
+        else:
+            self.backend = createBackend(backend, self.model)
+
+        self.streamExtractor = self.features.createStreamExtractor() # Computes features of new audio frames only
 
-        self.extractFun = self.features.extract_function
+    def clearBuffers(self):
+        self.streamExtractor.reset()
+        self.featuresBuffer.clear()
+        self.currentSignal.clear()
+        self.n_frames = 0
+        if self.streamingModel is not None:
+            self.streamingModel.reset()
 
     def init_audio(self):
-        self.featuresBuffer = np.zeros(self.features.feature_shape)
-        self.signalBuffer = np.array([])
+        import pyaudio # Only needed for live inference
+        self.clearBuffers()
         if self.audio is None:
+            self.paContinue = pyaudio.paContinue
             self.audio = pyaudio.PyAudio()
             self.stream = self.audio.open(format=pyaudio.paInt16,
                             channels=1,
@@ -52,7 +161,7 @@ class InferenceEngine(QtCore.QObject):
         if not self.isRunning:
             if self.audio == None:
                 self.init_audio()
-            self.currentSignal = bytes([0] * self.features.sample_s * 2)
+            self.clearBuffers()
             self.timeStamp = 0.0
             self.isRunning = True
             self.stream.start_stream()
@@ -61,41 +170,101 @@ class InferenceEngine(QtCore.QObject):
         if self.isRunning:
             self.stream.stop_stream()
             self.isRunning = False
-            self.featuresBuffer = np.zeros(self.features.feature_shape)
+            self.clearBuffers()
 
     def _onFrame(self, in_data, frame_count, time_info, status):
-        """ Called on every new audio frame"""
-        self.currentSignal += in_data
-        self.timeStamp += self.features.window_stride
-        frame = np.frombuffer(in_data, dtype='<i2').astype(np.float32, order='C') / 32767.0
-        self.signalBuffer = np.concatenate([self.signalBuffer, frame])
-        if len(self.signalBuffer) >= self.features.window_s:
-            feats = self.extractFun(self.signalBuffer)
-            self.signalBuffer = self.signalBuffer[self.features.window_stride_s * len(feats):]
-            self.currentSignal = self.currentSignal[len(in_data):]
-            self.featuresBuffer = np.concatenate([self.featuresBuffer, feats])[len(feats):]
-            pred = self.model.predict(self.featuresBuffer[np.newaxis])
+        """ Called on every new audio frame (PyAudio stream callback)"""
+        self.processFrame(in_data)
+        return (None, self.paContinue)
+
+    def processFrame(self, in_data):
+        """ Process an audio frame (16 bits PCM buffer), predict if new features frames are complete """
+        start = time.perf_counter()
+        pcm = np.frombuffer(in_data, dtype='<i2')
+        self.currentSignal.write(pcm)
+        self.timeStamp += len(pcm) / self.features.sample_rate
+        n_frames = self.n_frames
+        frame = self.frameBuffer[:len(pcm)] if len(pcm) <= len(self.frameBuffer) else np.empty(len(pcm), dtype=np.float32)
+        np.divide(pcm, np.float32(32767.0), out=frame)
+        feats = self.streamExtractor.push(frame)
+        self.featuresBuffer.write(feats)
+        self.n_frames += len(feats)
+        self.lastFrameTime = time.perf_counter() - start
+        if self.n_frames > n_frames:
+            start = time.perf_counter()
+            pred = None
+            if self.streamingModel is not None:
+                for row in feats:
+                    rowPred = self.streamingModel.predict(row)
+                    if self.streamingModel.windowComplete: # Partial window scores are not compared to the threshold
+                        pred = rowPred
+            else:
+                pred = self.backend.predict(self.featuresBuffer.view()[np.newaxis])
+            self.lastPredictionTime = time.perf_counter() - start
+            if pred is None:
+                return
             self.prediction.emit(self.timeStamp, list(pred))
             self._onPrediction(pred)
-        return (None, pyaudio.paContinue)
 
     def _onPrediction(self, predictions):
         """ Called everytime a prediction is made"""
-        if any(predictions > self.threshold):
+        if np.any(predictions > self.threshold):
             cp = np.argmax(predictions)
             if not self.f_det:
                 self.f_det = True
-                self.triggeringSignal = self.currentSignal
+                self.triggeringSignal = bytearray(self.currentSignal.view())
                 self.f_cp = cp
             else:
                 if self.f_cp == cp:
-                    self.triggeringSignal += self.currentSignal[-self.features.window_stride_s *2:] # Last frame size *2 (2B)
+                    self.triggeringSignal += self.currentSignal.last(self.features.window_stride_s).tobytes() # Last frame
                 else:
-                    self.sample_detection.emit(self.triggeringSignal, self.f_cp)
+                    self.sample_detected.emit(bytes(self.triggeringSignal), self.f_cp)
                     self.f_cp = cp
-                    self.triggeringSignal = self.currentSignal
+                    self.triggeringSignal = bytearray(self.currentSignal.view())
         elif self.f_det:
-            self.sample_detected.emit(self.triggeringSignal, self.f_cp)
+            self.sample_detected.emit(bytes(self.triggeringSignal), self.f_cp)
             self.f_det = False
                 
 
+    def replayFile(self, filePath: str, keepPredictions: bool = False) -> dict:
+        """ Run an audio file through the live inference processing, as fast as possible.
+
+        Returns a report dict with the file, its duration and the processing time (s), the detections as a list of
+        {"keyword": index, "start": s, "end": s} (triggering audio bounds) and, if keepPredictions, the predictions
+        as a list of (timestamp, [scores]).
+        """
+        from processing.files_to_feats import decode_pcm
+        pcm = decode_pcm(filePath, self.features.sample_rate)
+        detections = []
+        predictions = []
+        def onDetected(signal: bytes, keyword: int):
+            detections.append({"keyword": int(keyword), 
+                               "start": round(max(self.timeStamp - len(signal) / 2 / self.features.sample_rate, 0.0), 3),
+                               "end": round(self.timeStamp, 3)})
+        def onPrediction(timeStamp: float, pred: list):
+            predictions.append((round(timeStamp, 3), np.asarray(pred).ravel().tolist()))
+
+        self.clearBuffers()
+        self.timeStamp = 0.0
+        self.f_det = False
+        self.sample_detected.connect(onDetected)
+        if keepPredictions:
+            self.prediction.connect(onPrediction)
+        start = time.perf_counter()
+        try:
+            for i in range(0, len(pcm), self.features.window_stride_s):
+                self.processFrame(pcm[i : i + self.features.window_stride_s])
+            if self.f_det: # Detection running at the end of file
+                self.sample_detected.emit(bytes(self.triggeringSignal), self.f_cp)
+                self.f_det = False
+        finally:
+            self.sample_detected.disconnect(onDetected)
+            if keepPredictions:
+                self.prediction.disconnect(onPrediction)
+        report = {"file": filePath,
+                  "duration": len(pcm) / self.features.sample_rate,
+                  "processing_time": time.perf_counter() - start,
+                  "detections": detections}
+        if keepPredictions:
+            report["predictions"] = predictions
+        return report
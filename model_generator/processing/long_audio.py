@@ -0,0 +1,138 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from base import _Feature
+from processing.feature_store import fromPCM
+from processing.files_to_feats import decode_pcm, createOutputs
+
+def extract_recording(pcm: np.ndarray, features: _Feature, segment_length: float = 60.0) -> np.ndarray:
+    """ Extract the features frames of a whole recording (int16 PCM), returns (n_frames, n_feats).
+
+    Every frame is computed once, the result is identical to features.extract_function applied to the whole recording.
+    When the features provide a stream extractor, the recording is pushed by segments of segment_length seconds
+    to bound memory use on long recordings.
+    """
+    extractor = features.createStreamExtractor()
+    if extractor is None:
+        return np.asarray(features.extract_function(fromPCM(pcm)), dtype=np.float32)
+    segment = max(int(segment_length * features.sample_rate), 1)
+    feats = [extractor.push(fromPCM(pcm[start : start + segment])) for start in range(0, len(pcm), segment)]
+    if len(feats) == 0:
+        return np.empty((0, features.feature_shape[1]), dtype=np.float32)
+    return np.concatenate(feats).astype(np.float32)
+
+def window_view(feats: np.ndarray, n_win: int, stride: int = 1) -> np.ndarray:
+    """ Sliding windows of n_win frames every stride frames over (n_frames, n_feats) features.
+
+    Returns a read-only strided view of shape (n_windows, n_win, n_feats), no data is copied.
+    """
+    n_windows = max((len(feats) - n_win) // stride + 1, 0)
+    return as_strided(feats,
+                      shape=(n_windows, n_win, feats.shape[1]),
+                      strides=(feats.strides[0] * stride,) + feats.strides,
+                      writeable=False)
+
+def score_recording(filePath: str, features: _Feature, model, stride: int = 1, batch_size: int = 1024, backend: str = "function") -> tuple:
+    """ Predict every features window of a recording, one every stride frames.
+
+    Windows are views on the recording frames, they are copied to the model input batch_size at a time.
+
+    Returns (times, predictions, duration): times (n_windows, 2) holds the start and end of each window in seconds,
+    predictions is (n_windows, n_output) and duration the recording duration in seconds.
+    """
+    from processing.inference_engine import createBackend
+    pcm = decode_pcm(filePath, features.sample_rate)
+    n_win = features.feature_shape[0]
+    windows = window_view(extract_recording(pcm, features), n_win, stride)
+    predictor = createBackend(backend, model)
+    predictions = np.empty((len(windows), model.output_shape[-1]), dtype=np.float32)
+    for start in range(0, len(windows), batch_size):
+        predictions[start : start + batch_size] = predictor.predict(np.ascontiguousarray(windows[start : start + batch_size]))
+    starts = np.arange(len(windows)) * stride * features.window_stride_s
+    times = np.stack([starts, starts + (n_win - 1) * features.window_stride_s + features.window_s], axis=1) / features.sample_rate
+    return times, predictions, len(pcm) / features.sample_rate
+
+def find_activations(times: np.ndarray, predictions: np.ndarray, threshold: float) -> list:
+    """ Group consecutive windows triggering the same class into activations.
+
+    A window triggers when its highest prediction is above threshold, its class is then the index of that prediction + 1
+    (0 is no keyword, as in the evaluation confusion matrix).
+    Returns a list of (class, start, end) in seconds.
+    """
+    if len(predictions) == 0:
+        return []
+    classes = np.where(np.max(predictions, axis=1) > threshold, np.argmax(predictions, axis=1) + 1, 0)
+    boundaries = np.flatnonzero(np.diff(classes)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(classes)]])
+    kept = classes[starts] > 0
+    return list(zip(classes[starts][kept].tolist(), times[starts[kept], 0].tolist(), times[ends[kept] - 1, 1].tolist()))
+
+def match_events(activations: list, events: list) -> tuple:
+    """ Match activations (class, start, end) with expected events (class, start, end).
+
+    An activation is a false alarm if it doesn't overlap an event of its class, an event is missed if no activation
+    of its class overlaps it.
+    Returns (n_false_alarms, n_missed).
+    """
+    matched = [False] * len(events)
+    n_false_alarms = 0
+    for c, start, end in activations:
+        hit = False
+        for i, (ec, ev_start, ev_end) in enumerate(events):
+            if ec == c and start < ev_end and end > ev_start:
+                matched[i] = True
+                hit = True
+        if not hit:
+            n_false_alarms += 1
+    return n_false_alarms, matched.count(False)
+
+def eventClasses(events: list, labels: list) -> list:
+    """ Convert (label, start, end) events to (class, start, end) using the prepare_input_output output format.
+    Events labeled "" (no keyword) are dropped.
+    """
+    outputs = createOutputs(labels)
+    classes = []
+    for label, start, end in events:
+        if label not in outputs.keys():
+            raise Exception("Unknown event label {}, expected one of {}".format(label, labels))
+        if label != "":
+            classes.append((int(np.argmax(outputs[label])) + 1, start, end))
+    return classes
+
+def long_audio_metrics(scores: list, thresholds: list) -> list:
+    """ Compute false alarms per hour and miss rate at each threshold.
+
+    scores is a list of (times, predictions, duration, events) by recording, events being (class, start, end).
+    Returns a list of dict by threshold.
+    """
+    duration = sum([score[2] for score in scores])
+    n_events = sum([len(score[3]) for score in scores])
+    metrics = []
+    for threshold in thresholds:
+        n_false_alarms, n_missed = 0, 0
+        for times, predictions, _, events in scores:
+            false_alarms, missed = match_events(find_activations(times, predictions, threshold), events)
+            n_false_alarms += false_alarms
+            n_missed += missed
+        metrics.append({"threshold": threshold,
+                        "false_alarms": n_false_alarms,
+                        "false_alarms_per_hour": n_false_alarms / duration * 3600 if duration > 0 else 0.0,
+                        "missed": n_missed,
+                        "miss_rate": n_missed / n_events if n_events > 0 else 0.0})
+    return metrics
+
+def evaluate_recordings(recordings: list, features: _Feature, model, labels: list, thresholds: list, stride: int = 1,
+                        batch_size: int = 1024, backend: str = "function", traceCallBack = None) -> list:
+    """ Evaluate a model on long recordings.
+
+    recordings is a list of (filePath, events), events being the keywords said in the recording as (label, start, end)
+    in seconds, labels following the dataset labels. Each recording is scored once (see score_recording) and metrics are
+    computed at every threshold (see long_audio_metrics).
+    """
+    scores = []
+    for i, (filePath, events) in enumerate(recordings):
+        if traceCallBack is not None:
+            traceCallBack("Scoring {} ({}/{})".format(filePath, i + 1, len(recordings)))
+        scores.append(score_recording(filePath, features, model, stride, batch_size, backend) + (eventClasses(events, labels),))
+    return long_audio_metrics(scores, thresholds)
@@ -0,0 +1,64 @@
+import numpy as np
+
+def classTruth(outputs: np.ndarray) -> np.ndarray:
+    """ Class of each expected output (n_samples, n_labels): 0 for non-hotword, index of the label + 1 otherwise """
+    outputs = np.asarray(outputs)
+    return np.where(np.any(outputs > 0.0, axis=1), np.argmax(outputs, axis=1) + 1, 0)
+
+class ThresholdSweep:
+    """ Evaluation metrics at any threshold from a single set of predictions.
+
+    A sample triggers when its highest prediction is above the threshold, its predicted class is then the index of that
+    prediction + 1, 0 (non-hotword) otherwise. Samples are sorted once by score so that the samples triggering at a threshold
+    are a prefix of the sorted samples: the confusion matrix at a threshold is a count over that prefix and ROC / DET curves
+    are cumulative sums.
+    """
+    def __init__(self, outputs: np.ndarray, predictions: np.ndarray):
+        predictions = np.asarray(predictions)
+        self.n_class = predictions.shape[1] + 1
+        self.truth = classTruth(outputs)
+        self.scores = np.max(predictions, axis=1)
+        self.predicted = np.argmax(predictions, axis=1) + 1 # Predicted class when triggered
+        self.order = np.argsort(-self.scores, kind='stable')
+        self.sortedScores = self.scores[self.order] # Descending
+        self.sortedCells = self.truth[self.order] * self.n_class + self.predicted[self.order] # Confusion matrix cell when triggered
+        self.truthCount = np.bincount(self.truth, minlength=self.n_class)
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def n_triggered(self, threshold: float) -> int:
+        """ Number of samples whose score is above threshold """
+        threshold = self.scores.dtype.type(threshold) # Compare at the predictions precision
+        return int(np.searchsorted(-self.sortedScores, -threshold, side='left'))
+
+    def confusionMatrix(self, threshold: float) -> np.ndarray:
+        """ Confusion matrix (truth, predicted) at threshold, class 0 is non-hotword """
+        triggered = np.bincount(self.sortedCells[:self.n_triggered(threshold)], minlength=self.n_class ** 2).reshape(self.n_class, self.n_class)
+        triggered[:, 0] += self.truthCount - np.sum(triggered, axis=1)
+        return triggered
+
+    def classesPredicted(self, threshold: float) -> np.ndarray:
+        """ Predicted class of every sample at threshold """
+        return np.where(self.scores > self.scores.dtype.type(threshold), self.predicted, 0)
+
+    def curves(self) -> tuple:
+        """ Detection curves over every distinct score.
+
+        A hotword sample is detected if it triggers with its class, a non-hotword sample is a false positive if it triggers.
+        Returns (thresholds, false positive rate, false negative rate), thresholds in decreasing order, rates at
+        score > threshold. The first point is the threshold at which nothing triggers.
+        """
+        truth = self.truth[self.order]
+        detected = np.cumsum((truth > 0) & (truth == self.predicted[self.order]))
+        falsePositive = np.cumsum(truth == 0)
+        last = np.flatnonzero(np.diff(self.sortedScores) != 0) # Last sample of each distinct score
+        last = np.append(last, len(self) - 1) if len(self) > 0 else last
+        n_positive = max(len(self) - self.truthCount[0], 1)
+        n_negative = max(self.truthCount[0], 1)
+        # A threshold equal to a score doesn't trigger that score: report each point just below the score
+        below = np.nextafter(self.sortedScores[last], self.sortedScores.dtype.type(-np.inf))
+        thresholds = np.concatenate([[1.0], below])
+        fpr = np.concatenate([[0.0], falsePositive[last] / n_negative])
+        fnr = np.concatenate([[1.0], 1.0 - detected[last] / n_positive])
+        return thresholds, fpr, fnr
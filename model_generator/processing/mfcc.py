@@ -1,14 +1,24 @@
 import numpy as np
 from functools import lru_cache
+from numpy.lib.stride_tricks import as_strided
 from scipy.fftpack import dct
 
+from processing.ring_buffer import RingBuffer
+
 def safe_log(x):
     """Prevents error on log(0) or log(-1)"""
     return np.log(np.clip(x, np.finfo(float).eps, None))
 
 def split(array, window_size, window_stride):
-    n_win = int(np.floor((len(array) - window_size) / window_stride) + 1)
-    return np.array([array[i*window_stride: i*window_stride+window_size] for i in range(n_win)])
+    """ Split the last axis of array into overlapping windows.
+
+    Returns a read-only strided view of shape (..., n_win, window_size), no data is copied.
+    """
+    array = np.asarray(array)
+    n_win = max(int(np.floor((array.shape[-1] - window_size) / window_stride) + 1), 0)
+    shape = array.shape[:-1] + (n_win, window_size)
+    strides = array.strides[:-1] + (array.strides[-1] * window_stride, array.strides[-1])
+    return as_strided(array, shape=shape, strides=strides, writeable=False)
 
 @lru_cache
 def hamming_fun(length):
@@ -19,16 +29,22 @@ def do_hamming(frame: np.array):
     return frame * hamming_fun(frame.shape[-1])
 
 def preEmphasis(signal, factor=0.97):
-    return signal - np.concatenate([[0], signal[:-1] * factor])
+    """ Applies pre-emphasis along the last axis """
+    signal = np.asarray(signal)
+    emphasized = np.empty(signal.shape, dtype=np.result_type(signal.dtype, np.float64))
+    emphasized[..., :1] = signal[..., :1]
+    np.subtract(signal[..., 1:], signal[..., :-1] * factor, out=emphasized[..., 1:], dtype=emphasized.dtype)
+    return emphasized
 
 def power_spec(frames, fft_size=512):
     """Calculates power spectrogram"""
     fft = np.fft.rfft(frames, n=fft_size)
     return fft.real ** 2 + fft.imag ** 2
 
-@lru_cache()  # Prevents recalculating when calling with same parameters
-def mel_filter(sample_rate, num_filt, input_length):
-    
+@lru_cache()
+def mel_indexes(sample_rate, num_filt, input_length):
+    """ Spectrum indexes of the mel filters edges, filter i rises on [indexes[i], indexes[i + 1]) and falls on [indexes[i + 1], indexes[i + 2]) """
+
     def hertz_to_mels(f):
         return 1127. * np.log(1. + f / 700.)
 
@@ -37,7 +53,11 @@ def mel_filter(sample_rate, num_filt, input_length):
 
     mels_v = np.linspace(hertz_to_mels(0), hertz_to_mels(sample_rate), num_filt + 2, True)
     hertz_v = mel_to_hertz(mels_v)
-    indexes = (hertz_v * input_length / sample_rate).astype(int)
+    return (hertz_v * input_length / sample_rate).astype(int)
+
+@lru_cache()  # Prevents recalculating when calling with same parameters
+def mel_filter(sample_rate, num_filt, input_length):
+    indexes = mel_indexes(sample_rate, num_filt, input_length)
 
     filters = np.zeros([num_filt, input_length])
 
@@ -47,6 +67,51 @@ def mel_filter(sample_rate, num_filt, input_length):
 
     return filters
 
+@lru_cache()
+def mel_slopes(sample_rate, num_filt, input_length):
+    """ Rising and falling halves of the mel filters.
+
+    The halves of the same kind don't overlap, each kind is returned as (start, weights, segment_starts, empty):
+    weights covers the spectrum from start, the half of filter i begins at segment_starts[i], empty masks the filters
+    with an empty half (None if there are none).
+    """
+    indexes = mel_indexes(sample_rate, num_filt, input_length)
+    slopes = []
+    for edges, (begin, end) in [(indexes[:-1], (0., 1.)), (indexes[1:], (1., 0.))]:
+        weights = np.concatenate([np.linspace(begin, end, right - left, False) for left, right in zip(edges[:-1], edges[1:])])
+        segment_starts = np.minimum(edges[:-1] - edges[0], max(len(weights) - 1, 0))
+        empty = edges[:-1] == edges[1:]
+        slopes.append((edges[0], weights, segment_starts, empty if empty.any() else None))
+    return slopes
+
+def mel_projection(pow_spec, sample_rate, num_filt):
+    """ Project power spectrums (..., input_length) on the mel filter bank.
+
+    Each filter half is summed in order by add.reduceat, so that a frame gets the same values whatever the number
+    of frames it is computed with (a BLAS matrix product doesn't guarantee it).
+    """
+    energies = np.zeros(pow_spec.shape[:-1] + (num_filt,))
+    for start, weights, segment_starts, empty in mel_slopes(sample_rate, num_filt, pow_spec.shape[-1]):
+        if len(weights) == 0:
+            continue
+        sums = np.add.reduceat(pow_spec[..., start:start + len(weights)] * weights, segment_starts, axis=-1)
+        if empty is not None: # reduceat returns the element at the start of empty segments
+            sums[..., empty] = 0.
+        energies += sums
+    return energies
+
+def lmfe_frames(frames, sample_rate, fft_size, num_filter: int = 20, hamming: bool = False):
+    """ Log mel filterbank energies of pre-emphasized frames (..., n_frames, window_length) """
+    if hamming:
+        frames = do_hamming(frames)
+    pow_spec = power_spec(frames, fft_size)
+    return safe_log(mel_projection(pow_spec, sample_rate // 2, num_filter))
+
+def mfcc_frames(frames, sample_rate, fft_size, num_filter: int = 20, num_coef: int = 13, hamming: bool = False):
+    """ MFCCs of pre-emphasized frames (..., n_frames, window_length) """
+    mfccs = dct(lmfe_frames(frames, sample_rate, fft_size, num_filter, hamming), norm='ortho')
+    return mfccs[..., 1:num_coef+1]
+
 def lmfe_feats(signal, 
          sample_rate, 
          window_length, 
@@ -56,10 +121,7 @@ def lmfe_feats(signal,
          hamming: bool = False,
          preEmp : float = 0.97,):
     frames = split(preEmphasis(signal, preEmp), window_length, window_stride)
-    if hamming:
-        frames = do_hamming(frames)
-    pow_spec = power_spec(frames, fft_size)
-    return safe_log(np.dot(pow_spec, mel_filter(sample_rate // 2, num_filter, pow_spec.shape[-1]).T))
+    return lmfe_frames(frames, sample_rate, fft_size, num_filter, hamming)
 
 
 def mfcc_feats(signal, 
@@ -71,7 +133,57 @@ def mfcc_feats(signal,
          num_coef: int = 13, 
          hamming: bool = False,
          preEmp : float = 0.97,):
-    
-    lmfe = lmfe_feats(signal, sample_rate, window_length, window_stride, fft_size, num_filter, hamming, preEmp)
-    mfccs = dct(lmfe, norm='ortho')
-    return mfccs[::,1:num_coef+1]
\ No newline at end of file
+    frames = split(preEmphasis(signal, preEmp), window_length, window_stride)
+    return mfcc_frames(frames, sample_rate, fft_size, num_filter, num_coef, hamming)
+
+class StreamingMFCC:
+    """ Stateful MFCC extractor for audio streams.
+
+    Samples are pushed as they come, only the frames completed by the new samples are computed.
+    The last raw sample (pre-emphasis) and the overlapping samples are kept between calls, so that the rows produced
+    for a stream are identical to mfcc_feats applied to the whole stream.
+    """
+    def __init__(self,
+                 sample_rate, 
+                 window_length, 
+                 window_stride, 
+                 fft_size, 
+                 num_filter: int = 20, 
+                 num_coef: int = 13, 
+                 hamming: bool = False,
+                 preEmp : float = 0.97,):
+        self.sample_rate = sample_rate
+        self.window_length = window_length
+        self.window_stride = window_stride
+        self.fft_size = fft_size
+        self.num_filter = num_filter
+        self.num_coef = num_coef
+        self.hamming = hamming
+        self.preEmp = preEmp
+        self.emphasized = RingBuffer(window_length + window_stride, dtype=np.float64) # Pre-emphasized samples of pending frames
+        self.reset()
+
+    def reset(self):
+        """ Start a new stream """
+        self.emphasized.clear()
+        self.previous = None # Last raw sample
+        self.n_frames = 0
+
+    def push(self, samples) -> np.ndarray:
+        """ Add samples to the stream. Returns the new MFCC rows (n_new_frames, num_coef) """
+        samples = np.asarray(samples)
+        frames = []
+        for i in range(0, len(samples), self.window_stride):
+            chunk = samples[i : i + self.window_stride]
+            if self.previous is None:
+                self.emphasized.write(preEmphasis(chunk, self.preEmp))
+            else:
+                self.emphasized.write(preEmphasis(np.concatenate([self.previous, chunk]), self.preEmp)[1:])
+            self.previous = chunk[-1:].copy()
+            while self.emphasized.n_written >= self.n_frames * self.window_stride + self.window_length:
+                offset = self.emphasized.n_written - self.n_frames * self.window_stride
+                frames.append(self.emphasized.last(offset)[:self.window_length].copy())
+                self.n_frames += 1
+        if len(frames) == 0:
+            return np.empty((0, self.num_coef))
+        return mfcc_frames(np.array(frames), self.sample_rate, self.fft_size, self.num_filter, self.num_coef, self.hamming)
@@ -0,0 +1,178 @@
+import json
+
+import numpy as np
+import h5py
+
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x)) # Doesn't overflow on large negative values
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+activations = {
+    "linear": lambda x: x,
+    "tanh": np.tanh,
+    "sigmoid": sigmoid,
+    "relu": lambda x: np.maximum(x, 0),
+    "softmax": softmax,
+}
+
+def getActivation(name: str) -> callable:
+    if name not in activations.keys():
+        raise Exception("Activation {} is not supported by the numpy runtime".format(name))
+    return activations[name]
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+class NumpyGRU:
+    """ keras GRU layer """
+    def __init__(self, config: dict, weights: list):
+        if config.get("go_backwards", False):
+            raise Exception("Backward GRU are not supported by the numpy runtime")
+        self.units = config["units"]
+        self.activation = getActivation(config["activation"])
+        self.recurrent_activation = getActivation(config["recurrent_activation"])
+        self.reset_after = config["reset_after"]
+        self.return_sequences = config.get("return_sequences", False)
+        self.kernel = weights[0]
+        self.recurrent_kernel = weights[1]
+        bias = weights[2] if config["use_bias"] else np.zeros((2, 3 * self.units) if self.reset_after else 3 * self.units, dtype=np.float32)
+        if self.reset_after:
+            self.input_bias, self.recurrent_bias = bias[0], bias[1]
+        else:
+            self.input_bias, self.recurrent_bias = bias, np.zeros(3 * self.units, dtype=np.float32)
+
+    def initialState(self, batch_size: int) -> np.ndarray:
+        return np.zeros((batch_size, self.units), dtype=np.float32)
+
+    def project(self, x: np.ndarray) -> np.ndarray:
+        """ Input contribution to the gates (..., 3 * units), computed for all steps at once """
+        return np.matmul(x, self.kernel) + self.input_bias
+
+    def step(self, x_proj: np.ndarray, h: np.ndarray) -> np.ndarray:
+        """ Compute the next state from the projected input (batch, 3 * units) and the state (batch, units) """
+        u = self.units
+        if self.reset_after:
+            h_proj = np.matmul(h, self.recurrent_kernel) + self.recurrent_bias
+            z = self.recurrent_activation(x_proj[:, :u] + h_proj[:, :u])
+            r = self.recurrent_activation(x_proj[:, u:2*u] + h_proj[:, u:2*u])
+            hh = self.activation(x_proj[:, 2*u:] + r * h_proj[:, 2*u:])
+        else:
+            h_proj = np.matmul(h, self.recurrent_kernel[:, :2*u])
+            z = self.recurrent_activation(x_proj[:, :u] + h_proj[:, :u])
+            r = self.recurrent_activation(x_proj[:, u:2*u] + h_proj[:, u:2*u])
+            hh = self.activation(x_proj[:, 2*u:] + np.matmul(r * h, self.recurrent_kernel[:, 2*u:]))
+        return z * h + (1 - z) * hh
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        x_proj = self.project(x)
+        h = self.initialState(len(x))
+        outputs = []
+        for t in range(x.shape[1]):
+            h = self.step(x_proj[:, t], h)
+            outputs.append(h)
+        return np.stack(outputs, axis=1) if self.return_sequences else h
+
+class NumpyDense:
+    """ keras Dense layer """
+    def __init__(self, config: dict, weights: list):
+        self.activation = getActivation(config["activation"])
+        self.kernel = weights[0]
+        self.bias = weights[1] if config["use_bias"] else np.zeros(self.kernel.shape[-1], dtype=np.float32)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        return self.activation(np.matmul(x, self.kernel) + self.bias)
+
+class NumpyModel:
+    """ TensorFlow free inference of a trained model.
+
+    The .hdf5 file written by Training is read with h5py and GRU / Dense layers are computed with numpy
+    following the keras definitions (gates order z, r, h, both reset_after variants).
+    """
+    layerTypes = {"GRU": NumpyGRU, "Dense": NumpyDense}
+
+    def __init__(self, modelPath: str):
+        self.layers = []
+        self.input_shape = None
+        try:
+            with h5py.File(modelPath, 'r') as f:
+                manifest = json.loads(_decode(f.attrs["model_config"]))
+                weights = f["model_weights"] if "model_weights" in f.keys() else f
+                layers = manifest["config"]["layers"] if isinstance(manifest["config"], dict) else manifest["config"]
+                for layer in layers:
+                    config = layer["config"]
+                    if self.input_shape is None:
+                        self.input_shape = tuple(config.get("batch_shape", config.get("batch_input_shape", ())))[1:] or None
+                    if layer["class_name"] == "InputLayer":
+                        continue
+                    if layer["class_name"] not in NumpyModel.layerTypes.keys():
+                        raise Exception("Layer {} is not supported by the numpy runtime".format(layer["class_name"]))
+                    group = weights[config["name"]]
+                    layerWeights = [np.array(group[_decode(name)], dtype=np.float32) for name in group.attrs["weight_names"]]
+                    self.layers.append(NumpyModel.layerTypes[layer["class_name"]](config, layerWeights))
+        except Exception as e:
+            raise Exception("Could not load model {}: {}".format(modelPath, e))
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """ Predict a batch of features windows (batch, n_win, n_feats), returns (batch, n_output) """
+        x = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+class NumpyStreamingModel:
+    """ Frame by frame inference carrying the input GRU state between calls.
+
+    Modes are the ones of processing.streaming_model.StreamingModel:
+    - "continuous": the state is never reset.
+    - "windowed": the state is reset every n_window frames, the prediction on the last frame of each window is the full window prediction.
+    """
+    modes = ["continuous", "windowed"]
+
+    def __init__(self, model: NumpyModel, n_window: int, mode: str = "windowed"):
+        if mode not in NumpyStreamingModel.modes:
+            raise Exception("Unknown streaming mode {}, expected one of {}".format(mode, NumpyStreamingModel.modes))
+        if len(model.layers) == 0 or type(model.layers[0]) is not NumpyGRU:
+            raise Exception("Streaming inference needs a GRU input layer")
+        self.model = model
+        self.n_window = n_window
+        self.mode = mode
+        self.reset()
+
+    def reset(self):
+        self.state = self.model.layers[0].initialState(1)
+        self.n_frames = 0
+
+    def predict(self, frame: np.ndarray) -> np.ndarray:
+        """ Feed one features frame (n_feats,), returns the prediction (1, n_output) """
+        if self.mode == "windowed" and self.n_frames == self.n_window:
+            self.reset()
+        recurrent = self.model.layers[0]
+        self.state = recurrent.step(recurrent.project(np.asarray(frame, dtype=np.float32)[np.newaxis]), self.state)
+        self.n_frames += 1
+        x = self.state
+        for layer in self.model.layers[1:]:
+            x = layer(x)
+        return x
+
+def checkParity(modelPath: str, n_samples: int = 16, tolerance: float = 1e-4) -> tuple:
+    """ Compare numpy runtime and keras predictions on random inputs (batched and windowed streaming).
+
+    Returns (max absolute difference, max difference <= tolerance). Imports tensorflow.
+    """
+    from processing.keras_utils import loadModel
+    numpyModel = NumpyModel(modelPath)
+    kerasModel = loadModel(modelPath)
+    x = np.random.randn(n_samples, *kerasModel.input_shape[1:]).astype(np.float32)
+    reference = np.asarray(kerasModel(x, training=False))
+    diff = np.abs(numpyModel.predict(x) - reference).max()
+    if type(numpyModel.layers[0]) is NumpyGRU:
+        stream = NumpyStreamingModel(numpyModel, x.shape[1])
+        for sample, expected in zip(x, reference):
+            stream.reset()
+            for frame in sample:
+                pred = stream.predict(frame)
+            diff = max(diff, np.abs(pred[0] - expected).max())
+    return float(diff), bool(diff <= tolerance)
@@ -0,0 +1,67 @@
+import os
+import hashlib
+
+import numpy as np
+
+def modelFingerprint(modelPath: str) -> str:
+    """ Hash of the model checkpoint content """
+    sha = hashlib.sha1()
+    with open(modelPath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class PredictionCache:
+    """ Model predictions by sample, saved as a .npz file.
+
+    Predictions are keyed by sample key (see processing.feature_store.sampleKey) and are only valid for the model checkpoint
+    they were computed with: the cache content is dropped when loaded with another fingerprint.
+    """
+    def __init__(self, filePath: str, fingerprint: str):
+        self.filePath = filePath
+        self.fingerprint = fingerprint
+        self.index = dict() # key -> row
+        self.predictions = None
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.filePath):
+            return
+        try:
+            with np.load(self.filePath, allow_pickle=False) as content:
+                if str(content["fingerprint"]) != self.fingerprint:
+                    return
+                keys = content["keys"].tolist()
+                self.predictions = content["predictions"] if len(keys) > 0 else None
+        except Exception as e:
+            print("Could not read prediction cache {}: {}".format(self.filePath, e))
+            return
+        self.index = {key: i for i, key in enumerate(keys)}
+
+    def write(self):
+        """ Write the cache, rows replaced by update are dropped """
+        keys = list(self.index.keys())
+        predictions = self.predictions[[self.index[key] for key in keys]] if self.predictions is not None else np.zeros((0, 0), dtype=np.float32)
+        np.savez(self.filePath, fingerprint=np.array(self.fingerprint), keys=np.array(keys, dtype=str), predictions=predictions)
+
+    def missing(self, keys: list) -> list:
+        """ Return the indexes of keys without prediction """
+        return [i for i, key in enumerate(keys) if key not in self.index]
+
+    def get(self, keys: list) -> np.ndarray:
+        """ Return the predictions (len(keys), n_output) of keys, which must all be in the cache """
+        return self.predictions[[self.index[key] for key in keys]]
+
+    def update(self, keys: list, predictions: np.ndarray):
+        """ Add predictions (len(keys), n_output), existing keys point to the new rows """
+        predictions = np.asarray(predictions, dtype=np.float32)
+        n_rows = 0 if self.predictions is None else len(self.predictions)
+        self.predictions = predictions if self.predictions is None else np.concatenate([self.predictions, predictions])
+        for i, key in enumerate(keys):
+            self.index[key] = n_rows + i
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
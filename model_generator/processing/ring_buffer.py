@@ -0,0 +1,44 @@
+import numpy as np
+
+class RingBuffer:
+    """ Fixed capacity FIFO buffer of items of a given shape.
+
+    Items are written twice (at i and i + capacity) in an array of 2 * capacity items so that the last capacity items
+    are always available as a contiguous view. Writing and reading never allocate.
+    """
+    def __init__(self, capacity: int, shape: tuple = (), dtype = np.float32):
+        self.capacity = capacity
+        self.buffer = np.zeros((2 * capacity,) + tuple(shape), dtype=dtype)
+        self.position = 0 # Index of the oldest item
+        self.n_written = 0 # Number of items written since creation or last clear
+
+    def clear(self):
+        self.buffer.fill(0)
+        self.position = 0
+        self.n_written = 0
+
+    def write(self, values: np.ndarray):
+        """ Append values (n_items, *shape), the oldest items are overwritten """
+        n = len(values)
+        self.n_written += n
+        if n > self.capacity:
+            values = values[-self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self.position)
+        for start in [self.position, self.position + self.capacity]:
+            self.buffer[start : start + first] = values[:first]
+        if n > first:
+            for start in [0, self.capacity]:
+                self.buffer[start : start + n - first] = values[first:]
+        self.position = (self.position + n) % self.capacity
+
+    def view(self) -> np.ndarray:
+        """ Return the last capacity items, oldest first. The view is only valid until the next write. """
+        return self.buffer[self.position : self.position + self.capacity]
+
+    def last(self, n: int) -> np.ndarray:
+        """ Return the last n items, oldest first. The view is only valid until the next write. """
+        return self.buffer[self.position + self.capacity - n : self.position + self.capacity]
+
+    def __len__(self) -> int:
+        return self.capacity
@@ -0,0 +1,50 @@
+import numpy as np
+
+from base.model import _Model
+
+class StreamingModel:
+    """ Frame by frame inference of a trained GRU model.
+
+    The GRU hidden state is carried between calls so that each new features frame costs a single recurrent step
+    instead of running the whole features window (n_window steps) again.
+
+    Modes:
+    - "continuous": the state is never reset, predictions see the whole stream since start (or last reset()).
+      The model was trained on windows starting from a zero state, so predictions may drift on long streams.
+    - "windowed": the state is reset every n_window frames. The prediction made on the last frame of each window
+      is the full window prediction, predictions in between only see the frames since the last reset.
+
+    Predictions made before a whole window has been seen (windowComplete is False) come from inputs shorter than
+    the training windows, their scores are not comparable to the full window scores.
+    """
+    modes = ["continuous", "windowed"]
+
+    def __init__(self, modelDesc: _Model, model, n_window: int, mode: str = "windowed", backend: str = "function"):
+        from processing.inference_engine import createBackend, TFLiteBackend
+        if mode not in StreamingModel.modes:
+            raise Exception("Unknown streaming mode {}, expected one of {}".format(mode, StreamingModel.modes))
+        if backend == TFLiteBackend.name:
+            raise Exception("Streaming inference needs a keras backend, the TFLite model doesn't keep the recurrent state")
+        self.mode = mode
+        self.n_window = n_window
+        self.model = modelDesc.toStreamingKerasModel(model)
+        self.recurrentLayer = self.model.layers[0]
+        self.backend = createBackend(backend, self.model)
+        self.n_frames = 0 # Frames since last reset
+
+    def reset(self):
+        self.recurrentLayer.reset_states()
+        self.n_frames = 0
+
+    @property
+    def windowComplete(self) -> bool:
+        """ Whether the last prediction saw a whole window (in windowed mode: it is the full window prediction) """
+        return self.n_frames >= self.n_window
+
+    def predict(self, frame: np.ndarray) -> np.ndarray:
+        """ Feed one features frame (n_feats,), returns the prediction (1, n_output) """
+        if self.mode == "windowed" and self.n_frames == self.n_window:
+            self.reset()
+        pred = self.backend.predict(frame.reshape(1, 1, -1))
+        self.n_frames += 1
+        return pred
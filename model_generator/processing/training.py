@@ -1,10 +1,178 @@
+import os
+
+from PyQt5 import QtCore
+
+import numpy as np
+
+from base import DataSet
+from base.model import saveModel
+from processing.feature_store import FeatureStore
+from processing.files_to_feats import prepare_input_output, prepare_feature_store
+
 class TrainingSession:
-    def __init__(self, model, initialEpoch: int = 0):
-        self.model = model
+    def __init__(self, model = None, initialEpoch: int = 0):
+        self.model = model # Set by the training worker if None
         self.epoch = initialEpoch
         self.targetEpoch = self.epoch
-    
+        self.stopRequested = False
+
     def stopTraining(self):
-        self.model.stop_training = True
+        """ Request training to stop. Can be called from any thread, before or during model.fit """
+        self.stopRequested = True
+        if self.model is not None:
+            self.model.stop_training = True
+
+class TrainingStopped(Exception):
+    """ Raised in the training thread to stop feature extraction """
+    pass
+
+class TrainingWorker(QtCore.QObject):
+    """ Runs feature extraction and training of a trained profile. Meant to be moved to a QThread.
+
+    Progress is reported through signals, stop requests go through session.stopTraining().
+    finished is emitted once at least one epoch has been trained, stopped if the run ended before.
+    """
+    state_changed = QtCore.pyqtSignal(str, name='state_changed') # Progress message
+    epoch_ended = QtCore.pyqtSignal(int, dict, name='epoch_ended') # On epoch end emit (epoch, logs)
+    finished = QtCore.pyqtSignal(name='finished')
+    stopped = QtCore.pyqtSignal(name='stopped') # Stopped before any epoch was trained
+    failed = QtCore.pyqtSignal(str, name='failed') # On error emit (message)
+
+    def __init__(self, trained, session: TrainingSession, n_output: int, n_epoch: int, batch_size: int, shuffle: bool, streamInput: bool = True):
+        QtCore.QObject.__init__(self)
+        self.trained = trained
+        self.session = session
+        self.n_output = n_output
+        self.n_epoch = n_epoch
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.streamInput = streamInput
+        self.n_trained_epochs = 0
+
+    def run(self):
+        try:
+            self.train()
+        except TrainingStopped:
+            self.stopped.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            if self.n_trained_epochs > 0:
+                self.finished.emit()
+            else:
+                self.stopped.emit()
+
+    def train(self):
+        from processing.keras_utils import callbacksDef, loadModel
+
+        if self.session.model is None:
+            if self.trained.hasModel:
+                self.state_changed.emit("Loading neural net")
+                self.session.model = loadModel(self.trained.trainedModelPath)
+            else:
+                self.state_changed.emit("Creating neural net")
+                model = self.trained.model.toKerasModel(self.trained.features.feature_shape, self.n_output)
+                saveModel(model, self.trained.trainedModelPath)
+                self.trained.hasModel = True
+                self.session.model = model
+
+        # Fetch sets
+        trainSet = DataSet()
+        trainSet.loadDataSet(self.trained.trainSetPath)
+
+        valSet = DataSet()
+        valSet.loadDataSet(self.trained.valSetPath)
+
+        # prepare inputs / outputs
+        if self.streamInput:
+            # Stream batches from the feature cache
+            train_store, _, train_keys, train_output = prepare_feature_store([trainSet],
+                                                                            self.trained.features,
+                                                                            self.trained.featureCacheFolder,
+                                                                            traceCallBack=self.onProgress,
+                                                                            n_workers=os.cpu_count(),
+                                                                            audio_cache_folder=self.trained.audioCacheFolder)
+            val_store, _, val_keys, val_output = prepare_feature_store([valSet],
+                                                                      self.trained.features,
+                                                                      self.trained.featureCacheFolder,
+                                                                      traceCallBack=self.onProgress,
+                                                                      n_workers=os.cpu_count(),
+                                                                      audio_cache_folder=self.trained.audioCacheFolder)
+            fit_args = dict(x=createDataset(train_store, train_keys, train_output, self.batch_size, shuffle=self.shuffle))
+            val_data = createDataset(val_store, val_keys, val_output, self.batch_size, shuffle=False)
+        else:
+            train_input, train_output = prepare_input_output([trainSet],
+                                                            self.trained.features,
+                                                            traceCallBack=self.onProgress,
+                                                            save_features_folder=self.trained.featureCacheFolder,
+                                                            n_workers=os.cpu_count(),
+                                                            audio_cache_folder=self.trained.audioCacheFolder)
+            val_input, val_output = prepare_input_output([valSet],
+                                                         self.trained.features,
+                                                         traceCallBack=self.onProgress,
+                                                         save_features_folder=self.trained.featureCacheFolder,
+                                                         n_workers=os.cpu_count(),
+                                                         audio_cache_folder=self.trained.audioCacheFolder)
+            fit_args = dict(x=train_input, y=train_output, batch_size=self.batch_size, shuffle=self.shuffle)
+            val_data = (val_input, val_output)
+
+        # model.fit resets stop_training, stops requested during extraction are checked here
+        if self.session.stopRequested:
+            return
+
+        # Set callbacks
+        callbacks = callbacksDef(self.trained.trainedModelPath, self.onEpochEnd)
+
+        # training
+        self.state_changed.emit("Training...")
+        self.session.model.fit(initial_epoch=self.session.epoch,
+                               epochs= self.session.epoch + self.n_epoch + 1,
+                               callbacks=callbacks,
+                               validation_data=val_data,
+                               verbose=0,
+                               **fit_args)
+
+    def onProgress(self, msg: str):
+        """ Report extraction progress, stop requests interrupt the extraction between chunks """
+        if self.session.stopRequested:
+            raise TrainingStopped()
+        self.state_changed.emit(msg)
+
+    def onEpochEnd(self, epoch, logs = {}):
+        self.n_trained_epochs += 1
+        if self.session.stopRequested:
+            self.session.model.stop_training = True
+        self.epoch_ended.emit(epoch, dict(logs))
+
+def createDataset(store: FeatureStore, keys: list, outputs: np.ndarray, batch_size: int, shuffle: bool = True):
+    """ Create a tf.data pipeline streaming (features, outputs) batches from the feature store memory map.
+
+    Only sample indexes are shuffled (whole set, reshuffled each epoch), batches are gathered from disk by parallel map calls
+    and prefetched while the model trains on the previous batch, so the feature matrix never has to fit in memory.
+    """
+    import tensorflow as tf
+
+    matrix = store.matrix()
+    rows = store.rows(keys)
+    outputs = np.asarray(outputs, dtype=np.float32)
+    n_output = outputs.shape[1]
+
+    def gather(indexes):
+        # Sorted reads are sequential in the memory map, then put back in batch order
+        order = np.argsort(indexes)
+        batch = np.empty((len(indexes),) + store.feature_shape, dtype=np.float32)
+        batch[order] = matrix[rows[indexes[order]]]
+        return batch, outputs[indexes]
 
+    def load(indexes):
+        features, labels = tf.numpy_function(gather, [indexes], (tf.float32, tf.float32))
+        features.set_shape((None,) + store.feature_shape)
+        labels.set_shape((None, n_output))
+        return features, labels
 
+    dataset = tf.data.Dataset.range(len(keys))
+    if shuffle:
+        dataset = dataset.shuffle(len(keys), reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
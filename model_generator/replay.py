@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+
+from base import Project, DataSet
+from processing.inference_engine import InferenceEngine, backends, benchmarkBackends
+from processing.streaming_model import StreamingModel
+
+def main():
+    parser = argparse.ArgumentParser(description="Run audio files through a trained model (no microphone nor interface) and report detections.")
+    parser.add_argument("project", help="Project file")
+    parser.add_argument("trained", help="Trained model name")
+    parser.add_argument("files", nargs="*", help="Audio files or folders (.wav files are searched recursively)")
+    parser.add_argument("-t", "--threshold", type=float, default=0.5, help="Detection threshold (default 0.5)")
+    parser.add_argument("-o", "--output", help="Report file (JSON). Printed if not set")
+    parser.add_argument("--predictions", action="store_true", help="Add every prediction to the report")
+    parser.add_argument("--backend", choices=list(backends.keys()), default="function", help="Inference backend (default function)")
+    parser.add_argument("--streaming", choices=StreamingModel.modes, default=None, help="Run the model one frame at a time")
+    parser.add_argument("--benchmark", action="store_true", help="Measure the single prediction latency (ms) of each backend instead of processing files")
+    parser.add_argument("--calls", type=int, default=100, help="Predictions per backend with --benchmark (default 100)")
+    args = parser.parse_args()
+    if not args.benchmark and len(args.files) == 0:
+        parser.error("No audio file given")
+
+    project = Project()
+    project.open_project(args.project)
+    trained = project.getTrained(args.trained)
+    if not trained.isTrained:
+        print("Trained model {} has not been trained yet.".format(args.trained), file=sys.stderr)
+        sys.exit(1)
+
+    if args.benchmark:
+        from processing.keras_utils import loadModel
+        writeReport(benchmarkBackends(loadModel(trained.trainedModelPath), args.calls), args.output)
+        return
+
+    files = []
+    for path in args.files:
+        files.extend(sorted(DataSet.listFolder(path, recursive=True)) if os.path.isdir(path) else [path])
+
+    engine = InferenceEngine(trained.features,
+                             trained.trainedModelPath,
+                             args.threshold,
+                             modelDesc=trained.model,
+                             streamingMode=args.streaming,
+                             backend=args.backend)
+    reports = []
+    for i, filePath in enumerate(files):
+        try:
+            report = engine.replayFile(filePath, keepPredictions=args.predictions)
+        except Exception as e:
+            print("Failed to process {}: {}".format(filePath, e), file=sys.stderr)
+            continue
+        for detection in report["detections"]:
+            detection["keyword"] = project.keywords[detection["keyword"]]
+        reports.append(report)
+        print("[{}/{}] {}: {} detection(s), {:.1f}x real time".format(i + 1,
+                                                                     len(files),
+                                                                     filePath,
+                                                                     len(report["detections"]),
+                                                                     report["duration"] / max(report["processing_time"], 1e-6)),
+              file=sys.stderr)
+
+    duration = sum([report["duration"] for report in reports])
+    n_detections = sum([len(report["detections"]) for report in reports])
+    summary = {"trained": trained.name,
+               "threshold": args.threshold,
+               "duration": duration,
+               "processing_time": sum([report["processing_time"] for report in reports]),
+               "detections": n_detections,
+               "detections_per_hour": n_detections / duration * 3600 if duration > 0 else 0.0,
+               "files": reports}
+    writeReport(summary, args.output)
+
+def writeReport(report: dict, outputPath: str = None):
+    """ Write report as JSON to outputPath, print it if not set """
+    if outputPath is not None:
+        with open(outputPath, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
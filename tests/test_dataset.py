@@ -0,0 +1,59 @@
+import os
+import random
+
+from base import DataSet, Sample
+
+N_SAMPLES = 100000
+N_FOLDERS = 100
+
+def createDataSet(folder: str) -> DataSet:
+    dataset = DataSet("test", ["hey", "ok"])
+    dataset.datasetFile = os.path.join(folder, "test.json")
+    files = ["/data/f{}/s{}.wav".format(i % N_FOLDERS, i) for i in range(N_SAMPLES)]
+    for i, label in enumerate(["hey", "ok", ""]):
+        dataset.addSampleFiles(label, files[i::3])
+    return dataset
+
+def checkIndexes(dataset: DataSet):
+    files = [sample.file for sample in dataset.samples]
+    assert len(set(files)) == len(files)
+    for label in ["hey", "ok", ""]:
+        labelFiles = [sample.file for sample in dataset.samples if sample.label == label]
+        assert [sample.file for sample in dataset.getsubsetbyLabel(label)] == labelFiles
+        assert dataset.labelCount(label) == len(labelFiles)
+    indexed = []
+    for folder, labels in dataset.folderIndex.items():
+        for label, samples in labels.items():
+            assert all([os.path.dirname(sample.file) == folder and sample.label == label for sample in samples])
+            indexed.extend([sample.file for sample in samples])
+    assert sorted(indexed) == sorted(files)
+
+def test_remove_samples(tmp_path):
+    dataset = createDataSet(str(tmp_path))
+    random.seed(0)
+    removed = random.sample(dataset.samples, 5000)
+    removedFiles = set([sample.file for sample in removed])
+    # Removal is keyed on file: other Sample instances of the same files are removed
+    dataset.removeSamples([Sample({"file": sample.file}) for sample in removed] + [Sample({"file": "/data/unknown.wav"})])
+    assert len(dataset.samples) == N_SAMPLES - 5000
+    assert not any([sample.file in removedFiles for sample in dataset.samples])
+    checkIndexes(dataset)
+
+    reloaded = DataSet()
+    reloaded.loadDataSet(dataset.datasetFile) # JSON file and journal
+    assert [sample.sampleDesc for sample in reloaded.samples] == [sample.sampleDesc for sample in dataset.samples]
+    checkIndexes(reloaded)
+
+def test_remove_from_folders(tmp_path):
+    dataset = createDataSet(str(tmp_path))
+    folders = ["/data/f{}".format(i) for i in range(0, N_FOLDERS, 7)]
+    dataset.removeFromFolders(folders + ["/data/unknown"])
+    assert len(dataset.samples) == N_SAMPLES - len(folders) * N_SAMPLES // N_FOLDERS
+    assert not any([os.path.dirname(sample.file) in folders for sample in dataset.samples])
+    assert not any([folder in dataset.folderIndex for folder in folders])
+    checkIndexes(dataset)
+
+    reloaded = DataSet()
+    reloaded.loadDataSet(dataset.datasetFile)
+    assert [sample.sampleDesc for sample in reloaded.samples] == [sample.sampleDesc for sample in dataset.samples]
+    checkIndexes(reloaded)
@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from processing.feature_store import FeatureStore, AudioCache
+
+SHAPE = (4, 3)
+
+def features(n, value):
+    return np.full((n,) + SHAPE, value, dtype=np.float64)
+
+def append_rows(folder, prefix, n_chunks):
+    store = FeatureStore(folder, SHAPE)
+    for c in range(n_chunks):
+        store.append(["{}{}_{}".format(prefix, c, i) for i in range(8)], features(8, c))
+
+def test_rows_are_kept_without_final_index_write(tmp_path):
+    store = FeatureStore(str(tmp_path), SHAPE)
+    store.append(["a", "b"], features(2, 1.0))
+    store.append(["c"], features(1, 2.0))
+    reopened = FeatureStore(str(tmp_path), SHAPE) # Writer still running or killed: nothing else is written
+    assert len(reopened) == 3
+    assert np.all(reopened.getFeatures(["c"]) == 2.0)
+
+def test_concurrent_store_doesnt_truncate_appended_rows(tmp_path):
+    a = FeatureStore(str(tmp_path), SHAPE)
+    a.append(["a0", "a1"], features(2, 1.0))
+    b = FeatureStore(str(tmp_path), SHAPE) # Opened while a is extracting
+    a.append(["a2"], features(1, 2.0))
+    b.append(["b0"], features(1, 3.0))
+    a.append(["a3"], features(1, 4.0))
+    reopened = FeatureStore(str(tmp_path), SHAPE)
+    assert len(reopened) == 5
+    for key, value in [("a0", 1.0), ("a2", 2.0), ("b0", 3.0), ("a3", 4.0)]:
+        assert np.all(reopened.getFeatures([key]) == value)
+
+def test_interrupted_append_is_truncated(tmp_path):
+    store = FeatureStore(str(tmp_path), SHAPE)
+    store.append(["a"], features(1, 1.0))
+    with open(store.dataPath, 'ab') as f: # Data written, index entry missing
+        features(3, 9.0).tofile(f)
+    with open(store.journalPath, 'a') as f:
+        f.write('{"index": {"x"') # Torn journal line
+    reopened = FeatureStore(str(tmp_path), SHAPE)
+    assert len(reopened) == 1
+    reopened.append(["b"], features(1, 2.0))
+    reopened = FeatureStore(str(tmp_path), SHAPE)
+    assert sorted(reopened.index.keys()) == ["a", "b"]
+    assert os.path.getsize(reopened.dataPath) == 2 * reopened.rowSize
+    assert np.all(reopened.getFeatures(["a", "b"])[:, 0, 0] == [1.0, 2.0])
+
+def test_other_shape_drops_content(tmp_path):
+    FeatureStore(str(tmp_path), SHAPE).append(["a"], features(1, 1.0))
+    other = FeatureStore(str(tmp_path), (2, 2))
+    assert len(other) == 0
+    other.append(["b"], np.ones((1, 2, 2)))
+    assert list(FeatureStore(str(tmp_path), (2, 2)).index.keys()) == ["b"]
+
+def test_processes_append_concurrently(tmp_path):
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(append_rows, [str(tmp_path)] * 4, ["p0_", "p1_", "p2_", "p3_"], [20] * 4))
+    store = FeatureStore(str(tmp_path), SHAPE)
+    assert len(store) == 4 * 20 * 8 and store.n_rows == 4 * 20 * 8
+    for p in range(4):
+        for c in range(20):
+            assert np.all(store.getFeatures(["p{}_{}_{}".format(p, c, i) for i in range(8)]) == c)
+
+def test_audio_cache(tmp_path):
+    cache = AudioCache(str(tmp_path), 16000)
+    cache.append(["a", "b"], [np.arange(5, dtype='<i2'), np.arange(3, dtype='<i2')])
+    other = AudioCache(str(tmp_path), 16000)
+    cache.append(["c"], [np.arange(2, dtype='<i2')])
+    other.append(["d"], [np.arange(4, dtype='<i2')])
+    reopened = AudioCache(str(tmp_path), 16000)
+    assert reopened.n_samples == 14
+    for key, length in [("a", 5), ("b", 3), ("c", 2), ("d", 4)]:
+        assert np.array_equal(reopened.getPCM(key), np.arange(length))
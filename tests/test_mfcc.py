@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from processing.mfcc import mfcc_feats, mel_filter, mel_projection, power_spec, StreamingMFCC
+
+@pytest.mark.parametrize("chunk_size", [1, 160, 1000, 48000])
+def test_streaming_equals_offline(chunk_size):
+    signal = np.random.RandomState(0).randn(48000)
+    params = (16000, 1024, 512, 512) # sample_rate, window_length, window_stride, fft_size
+    extractor = StreamingMFCC(*params)
+    streamed = np.concatenate([extractor.push(signal[i:i + chunk_size]) for i in range(0, len(signal), chunk_size)])
+    assert np.array_equal(streamed, mfcc_feats(signal, *params))
+
+@pytest.mark.parametrize("sample_rate, num_filt, fft_size", [(8000, 20, 512), (8000, 26, 1024), (4000, 40, 64)])
+def test_mel_projection_matches_filter_bank(sample_rate, num_filt, fft_size):
+    pow_spec = power_spec(np.random.RandomState(0).randn(3, 30, 1024), fft_size)
+    expected = np.dot(pow_spec, mel_filter(sample_rate, num_filt, pow_spec.shape[-1]).T)
+    np.testing.assert_allclose(mel_projection(pow_spec, sample_rate, num_filt), expected, rtol=1e-12, atol=1e-9)
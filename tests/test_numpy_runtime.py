@@ -0,0 +1,22 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from base.model import GRU_Model, saveModel
+from processing.numpy_runtime import checkParity
+
+@pytest.mark.parametrize("reset_after", [True, False])
+def test_gru_model_parity(tmp_path, reset_after):
+    np.random.seed(0)
+    modelDesc = GRU_Model("gru")
+    modelDesc.layers[0].reset_after = reset_after
+    model = modelDesc.toKerasModel((30, 13), 2)
+    # Non zero biases. Larger weights make the linear GRU state diverge, differences are then rounding errors amplification
+    model.set_weights([w + np.random.randn(*w.shape).astype(np.float32) * 0.1 for w in model.get_weights()])
+    modelPath = os.path.join(str(tmp_path), "model.hdf5")
+    saveModel(model, modelPath)
+    diff, ok = checkParity(modelPath)
+    assert ok, "max difference {}".format(diff)